@@ -0,0 +1,130 @@
+from __future__ import annotations
+import sys, json, time, shutil, tempfile, argparse
+from pathlib import Path
+
+import buscar_facturas as bf
+from control_concurrencia import ControlConcurrencia
+from graph_simulado import GraphSimulado
+
+# === Benchmark de buscar() contra el Graph simulado (sin red ni tenant) ===
+MODOS = {
+    "individual": {},
+    "batch": {"batch": True},
+    "rangos": {"rangos": True},
+    "rangos+batch": {"rangos": True, "batch": True},
+}
+
+
+def _percentil(valores, p):
+    if not valores:
+        return 0.0
+    orden = sorted(valores)
+    return orden[min(len(orden) - 1, int(round(p / 100 * (len(orden) - 1))))]
+
+
+def _preparar_entorno(graph: GraphSimulado, tmp: Path):
+    """Apunta buscar_facturas al servidor simulado y a carpetas temporales."""
+    bf.BASE = graph.url
+    bf._apply_token("benchmark-" + "x" * 30)
+    bf.BASE_DIR = tmp
+    bf.IDS_CACHE_PATH = tmp / "ids.json"
+    bf.ARCHIVOS_CACHE_PATH = tmp / "archivos.json"
+    bf.ONEDRIVE_BASES = [tmp / "onedrive"]  # vacío: los PDFs se descargan de Graph
+    bf._indice_archivos = None
+    bf._filtro_carpeta_activo = bf.FILTRO_CARPETA_SERVIDOR
+    bf.GRAPH_BACKOFF_BASE = 0.05
+    if bf.GRAPH_CONCURRENCIA_ADAPTATIVA:
+        bf._control = ControlConcurrencia(inicial=4, maximo=bf.GRAPH_CONCURRENCIA_MAX)
+
+
+def medir(graph: GraphSimulado, facturas, opciones: dict, workers=None, copia_workers=None) -> dict:
+    """
+    Ejecuta una búsqueda y devuelve tiempos, latencias HTTP (sin la espera de turno
+    del control de concurrencia) y contadores del servidor.
+    """
+    latencias = []
+    tmp = Path(tempfile.mkdtemp(prefix="bench_busqueda_"))
+    try:
+        _preparar_entorno(graph, tmp)
+        graph.reiniciar_contadores()
+        # Pool ya dimensionado para que buscar() no recree la sesión medida
+        if workers is None:
+            workers = bf.GRAPH_CONCURRENCIA_MAX if bf._control else bf.BUSCAR_WORKERS
+        bf.set_pool_size(max(bf.GRAPH_POOL_SIZE, workers))
+        sesion = bf._get_session()
+        request_original = sesion.request
+
+        def request_medido(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return request_original(*args, **kwargs)
+            finally:
+                latencias.append(time.perf_counter() - t0)
+
+        sesion.request = request_medido
+        t0 = time.perf_counter()
+        r = bf.buscar(facturas, workers=workers, indice=False, cache=False, diario=False,
+                      local_primero=False, refrescar_ids=True, copia_workers=copia_workers, **opciones)
+        segundos = time.perf_counter() - t0
+    finally:
+        bf.set_pool_size(bf.GRAPH_POOL_SIZE)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    return {
+        "facturas": len(facturas),
+        "segundos": round(segundos, 3),
+        "fact_s": round(len(facturas) / segundos, 1),
+        "p50_ms": round(_percentil(latencias, 50) * 1000, 1),
+        "p95_ms": round(_percentil(latencias, 95) * 1000, 1),
+        "peticiones": len(latencias),
+        "servidor": dict(sorted(graph.contadores.items())),
+        "encontradas": len(r["encontradas"]),
+        "no_encontradas": len(r["no_encontradas"]),
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark de buscar() contra un Graph simulado local")
+    p.add_argument("--tamanos", type=int, nargs="+", default=[100, 500, 2000], help="Facturas por búsqueda")
+    p.add_argument("--modos", nargs="+", default=list(MODOS), choices=list(MODOS))
+    p.add_argument("--workers", type=int, default=None)
+    p.add_argument("--copia-workers", type=int, default=None, help="Hilos de la etapa de copia/descarga")
+    p.add_argument("--latencia-ms", type=float, default=20.0)
+    p.add_argument("--throttle", type=float, default=0.0, help="Probabilidad de 429 por petición")
+    p.add_argument("--max-en-vuelo", type=int, default=0, help="429 por encima de este número de peticiones simultáneas")
+    p.add_argument("--corte", type=float, default=0.0, help="Probabilidad de cortar una descarga a mitad del cuerpo")
+    p.add_argument("--tam-pdf-kb", type=int, default=50, help="Tamaño de los PDFs simulados")
+    p.add_argument("--chunk-kb", type=int, default=None,
+                   help="Bloque de descarga (por defecto DESCARGA_CHUNK; con --corte, 1/8 del PDF)")
+    p.add_argument("--json", help="Guarda los resultados en este archivo")
+    args = p.parse_args(argv)
+
+    # Con bloques mayores que el PDF, un corte pierde el bloque a medias y la descarga
+    # empieza de cero: para ejercitar la reanudación con Range el bloque debe ser menor
+    if args.chunk_kb:
+        bf.DESCARGA_CHUNK = args.chunk_kb * 1024
+    elif args.corte:
+        bf.DESCARGA_CHUNK = max(1024, args.tam_pdf_kb * 1024 // 8)
+
+    resultados = []
+    print(f"{'modo':<14}{'N':>7}{'fact/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'petic.':>8}{'429':>6}  servidor")
+    for n in args.tamanos:
+        with GraphSimulado(n, latencia_ms=args.latencia_ms, prob_throttle=args.throttle,
+                           max_en_vuelo=args.max_en_vuelo, prob_corte=args.corte,
+                           tam_pdf=args.tam_pdf_kb * 1024) as graph:
+            for modo in args.modos:
+                r = medir(graph, list(graph.facturas), MODOS[modo], args.workers, args.copia_workers)
+                r["modo"] = modo
+                resultados.append(r)
+                print(f"{modo:<14}{n:>7}{r['fact_s']:>10}{r['p50_ms']:>9}{r['p95_ms']:>9}"
+                      f"{r['peticiones']:>8}{r['servidor'].get('throttled', 0):>6}  {r['servidor']}")
+                sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+    return resultados
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,11 @@ import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import pandas as pd
 import threading
+import multiprocessing
 from pathlib import Path
 from buscar_facturas import buscar as buscar_en_sharepoint
 from buscar_facturas import set_graph_token 
+from buscar_facturas import CanalProgreso
 from vista_excel import ExcelTableViewer
 
 BASE_DIR = Path(sys.executable).parent if getattr(sys, "frozen", False) else Path(__file__).parent
@@ -401,7 +403,7 @@ class App(tk.Tk):
         frm = ttk.Frame(win, style="Card.TFrame", padding=16)
         frm.pack(fill="both", expand=True)
 
-        self._loading_label = ttk.Label(frm, text=message, style="Title.TLabel")
+        self._loading_label = ttk.Label(frm, text=message, style="Title.TLabel", wraplength=380)
         self._loading_label.pack(anchor="w", pady=(0,8))
 
         pb = ttk.Progressbar(frm, mode="indeterminate", length=360, style="Loading.Horizontal.TProgressbar")
@@ -425,22 +427,38 @@ class App(tk.Tk):
         self._loading_win = None
         self._loading_label = None
 
-    def _run_in_bg_with_progress(self, start_message, worker_func, done_callback):
+    def _run_in_bg_with_progress(self, start_message, worker_func, done_callback, frame_ms=100):
         self._show_loading(start_message)
 
+        # El worker escribe en el canal (sin tocar Tk); el mainloop lo publica a ritmo fijo
+        canal = CanalProgreso()
+        estado = {"terminado": False, "version": 0}
+
+        def publicar():
+            if estado["terminado"]:
+                return
+            version, texto = canal.snapshot()
+            if version != estado["version"]:
+                estado["version"] = version
+                self._update_loading_message(texto)
+            self.after(frame_ms, publicar)
+
         def worker():
             res, err = None, None
             try:
-                def on_progress(msg: str):
-                    # actualizar desde el hilo, pero en el mainloop
-                    self.after(0, lambda: self._update_loading_message(msg))
                 # el worker debe aceptar ese callback
-                res = worker_func(on_progress)
+                res = worker_func(canal)
             except Exception as e:
                 err = e
+
             # cerrar modal + callback en hilo principal
-            self.after(0, lambda: (self._hide_loading(), done_callback(res, err)))
+            def fin():
+                estado["terminado"] = True
+                self._hide_loading()
+                done_callback(res, err)
+            self.after(0, fin)
 
+        self.after(frame_ms, publicar)
         threading.Thread(target=worker, daemon=True).start()
 
 
@@ -516,7 +534,8 @@ class App(tk.Tk):
                     self._open_token_config()
                     messagebox.showinfo(
                         "Info",
-                        "Después de guardar el token, vuelve a presionar 'Buscar en SharePoint'.",
+                        "Después de guardar el token, vuelve a presionar 'Buscar en SharePoint'.\n"
+                        "La búsqueda continúa desde donde quedó.",
                         parent=self
                     )
                 else:
@@ -703,5 +722,7 @@ class App(tk.Tk):
 
 
 if __name__ == "__main__":
+    # El ejecutable (PyInstaller) lanza procesos de extracción: deben arrancar sin abrir la UI
+    multiprocessing.freeze_support()
     app = App()
     app.mainloop()
@@ -1,11 +1,19 @@
-import os, sys, shutil, requests
+import os, re, sys, json, shutil, time, random, threading, requests
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, Future
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv, set_key
 
 from rutas import (
     SP_HOST, SITE_ID, DRIVE_ID, LIB_PARTIAL_NAME,
     SUBCARPETA_SERVER_REL, COLUMNA_FACTURA_INTERNAL
 )
+from indice_sharepoint import IndiceFacturas, CacheConsultas
+from indice_archivos import IndiceArchivos
+from copia_archivos import copiar_si_cambio, COPIADO, SIN_CAMBIOS
+from control_concurrencia import ControlConcurrencia
+from diario_busqueda import DiarioBusqueda, id_trabajo, diarios_pendientes
 
 BASE_DIR = Path(sys.executable).parent if getattr(sys, "frozen", False) else Path(__file__).parent
 ENV_PATH = BASE_DIR / ".env"
@@ -34,6 +42,87 @@ ONEDRIVE_BASES = [
 
 BASE = "https://graph.microsoft.com/v1.0"
 
+# Pool de conexiones y reintentos (configurables por .env)
+GRAPH_POOL_SIZE = int(os.getenv("GRAPH_POOL_SIZE") or 16)
+GRAPH_MAX_RETRIES = int(os.getenv("GRAPH_MAX_RETRIES") or 5)
+GRAPH_BACKOFF_BASE = float(os.getenv("GRAPH_BACKOFF_BASE") or 1.0)
+GRAPH_BACKOFF_MAX = 60.0
+GRAPH_TIMEOUT = 30
+_RETRY_STATUS = {429, 502, 503, 504}
+
+# Facturas resueltas en paralelo por buscar()
+BUSCAR_WORKERS = int(os.getenv("BUSCAR_WORKERS") or 4)
+
+# Resolver primero por nombre de archivo en ONEDRIVE_BASES (sin token ni red)
+BUSCAR_LOCAL_PRIMERO = (os.getenv("BUSCAR_LOCAL_PRIMERO") or "0").strip().lower() in ("1", "true", "si", "sí")
+
+# Máximo de sub-peticiones por POST a /$batch (límite de Graph)
+GRAPH_BATCH_SIZE = 20
+
+# Búsqueda por rangos: las facturas PREFIJO+NÚMERO consecutivas se piden con un solo
+# filtro ge/le paginado. Un rango se corta ante un hueco de más de RANGO_MAX_HUECO
+# números o si abarca más de RANGO_MAX_SPAN; con menos de RANGO_MIN_FACTURAS no compensa.
+BUSCAR_RANGOS = (os.getenv("BUSCAR_RANGOS") or "0").strip().lower() in ("1", "true", "si", "sí")
+RANGO_MAX_HUECO = int(os.getenv("RANGO_MAX_HUECO") or 25)
+RANGO_MAX_SPAN = int(os.getenv("RANGO_MAX_SPAN") or 2000)
+RANGO_MIN_FACTURAS = 3
+RANGO_PAGINA = 999
+
+# Filtrar por SUBCARPETA_SERVER_REL en la propia consulta (startswith sobre FileDirRef).
+# Si Graph lo rechaza (columna sin indexar) se desactiva en la sesión y el filtro
+# queda solo en el cliente, como siempre.
+FILTRO_CARPETA_SERVIDOR = (os.getenv("FILTRO_CARPETA_SERVIDOR") or "1").strip().lower() in ("1", "true", "si", "sí")
+_filtro_carpeta_activo = FILTRO_CARPETA_SERVIDOR
+
+# Caché en disco de los IDs de biblioteca/lista (cambian casi nunca)
+IDS_CACHE_PATH = BASE_DIR / ".cache_graph_ids.json"
+IDS_CACHE_TTL_HORAS = float(os.getenv("GRAPH_IDS_TTL_HORAS") or 168)
+_ids_lock = threading.Lock()
+
+# Caché de consultas por factura: positivas y negativas (sin resultados) con
+# vigencias distintas; las consultas simultáneas por la misma factura se comparten.
+# Las negativas no se reutilizan por defecto (0): al repetir una búsqueda tras subir
+# las facturas que faltaban, justo esas son las que hay que volver a consultar.
+CACHE_CONSULTAS_TTL_HORAS = float(os.getenv("CACHE_CONSULTAS_TTL_HORAS") or 24)
+CACHE_NEGATIVOS_TTL_MIN = float(os.getenv("CACHE_NEGATIVOS_TTL_MIN") or 0)
+_cache_consultas = None
+_en_vuelo = {}
+_en_vuelo_lock = threading.Lock()
+
+# Hilos de E/S para copiar PDFs, separados de los de consultas a Graph
+COPIA_WORKERS = int(os.getenv("COPIA_WORKERS") or 4)
+
+# Copia a Facturas_descargadas: incremental (omite PDFs idénticos) o completa,
+# con enlace "reflink" / "hardlink" / "no" cuando el sistema de archivos lo permite
+COPIA_INCREMENTAL = (os.getenv("COPIA_MODO") or "incremental").strip().lower() != "completa"
+COPIA_ENLACE = (os.getenv("COPIA_ENLACE") or "reflink").strip().lower()
+COPIA_VERIFICAR_HASH = (os.getenv("COPIA_VERIFICAR_HASH") or "0").strip().lower() in ("1", "true", "si", "sí")
+
+# Si el PDF no está hidratado en ONEDRIVE_BASES, descargarlo de Graph (/driveItem/content)
+DESCARGA_GRAPH = (os.getenv("DESCARGA_GRAPH") or "1").strip().lower() in ("1", "true", "si", "sí")
+DESCARGA_CHUNK = 1024 * 1024
+
+# Diario de búsquedas: cada factura resuelta se anota en disco; si la búsqueda se corta
+# (token vencido, equipo suspendido), repetirla con las mismas facturas retoma desde ahí
+BUSCAR_DIARIO = (os.getenv("BUSCAR_DIARIO") or "1").strip().lower() in ("1", "true", "si", "sí")
+DIARIOS_DIR = BASE_DIR / ".trabajos_busqueda"
+# Resultados anotados hace más de esto se vuelven a buscar (SharePoint puede haber cambiado)
+DIARIO_MAX_HORAS = float(os.getenv("DIARIO_MAX_HORAS") or 24)
+
+# Índice de nombres de archivo bajo ONEDRIVE_BASES (incluye subcarpetas)
+ARCHIVOS_CACHE_PATH = BASE_DIR / ".cache_archivos_onedrive.json"
+_indice_archivos = None
+_indice_archivos_lock = threading.Lock()
+
+_session = None
+_session_lock = threading.Lock()
+
+# Concurrencia adaptativa (AIMD): el número de peticiones en vuelo sube mientras
+# Graph responde bien y se recorta ante 429/503. Con 0 se usa solo BUSCAR_WORKERS.
+GRAPH_CONCURRENCIA_ADAPTATIVA = (os.getenv("GRAPH_CONCURRENCIA_ADAPTATIVA") or "1").strip().lower() in ("1", "true", "si", "sí")
+GRAPH_CONCURRENCIA_MAX = int(os.getenv("GRAPH_CONCURRENCIA_MAX") or 32)
+_control = ControlConcurrencia(inicial=4, maximo=GRAPH_CONCURRENCIA_MAX) if GRAPH_CONCURRENCIA_ADAPTATIVA else None
+
 # === API Token desde UI ===
 def set_graph_token(new_token: str, persist: bool = True):
     """
@@ -46,13 +135,119 @@ def set_graph_token(new_token: str, persist: bool = True):
         set_key(str(ENV_PATH), "GRAPH_TOKEN", new_token.strip())
     _apply_token(new_token)
 
-# === API Graph para SharePoint ===
-def _get(url: str):
+class TokenVencido(RuntimeError):
+    """Graph respondió 401: hay que pegar un token nuevo (la búsqueda se puede reanudar)."""
+
+# === Sesión HTTP compartida (keep-alive + reintentos) ===
+def _get_session() -> requests.Session:
+    """
+    Devuelve la sesión compartida por todas las llamadas a Graph.
+    Reutiliza conexiones TCP/TLS entre facturas y páginas de @odata.nextLink.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=GRAPH_POOL_SIZE)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _session = s
+    return _session
+
+def set_pool_size(size: int):
+    """Cambia el tamaño del pool; la sesión se recrea en la siguiente llamada."""
+    global GRAPH_POOL_SIZE, _session
+    with _session_lock:
+        GRAPH_POOL_SIZE = max(1, int(size))
+        if _session is not None:
+            _session.close()
+        _session = None
+
+def _retry_after_segundos(valor):
+    """Interpreta Retry-After (segundos o fecha HTTP). None si no viene o no se entiende."""
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(valor).timestamp() - time.time())
+    except Exception:
+        return None
+
+def _espera_reintento(intento: int, retry_after=None) -> float:
+    """
+    Backoff exponencial con jitter (hasta GRAPH_BACKOFF_MAX); si Graph manda Retry-After
+    se espera eso completo, aunque pase de GRAPH_BACKOFF_MAX: reintentar antes solo
+    gasta reintentos en más 429.
+    """
+    techo = min(GRAPH_BACKOFF_MAX, GRAPH_BACKOFF_BASE * (2 ** intento))
+    segundos = _retry_after_segundos(retry_after)
+    if segundos is not None:
+        return segundos + random.uniform(0, GRAPH_BACKOFF_BASE)
+    return random.uniform(0, techo)
+
+def _enviar(session, method, url, headers, **kwargs):
+    """Una sola petición; si hay control adaptativo, espera turno y le informa el resultado."""
+    if _control is None:
+        return session.request(method, url, headers=headers, timeout=GRAPH_TIMEOUT, **kwargs)
+    with _control.turno():
+        t0 = time.monotonic()
+        try:
+            r = session.request(method, url, headers=headers, timeout=GRAPH_TIMEOUT, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            _control.registrar(None)
+            raise
+    latencia = None if _latencia_no_comparable(url) else time.monotonic() - t0
+    _control.registrar(r.status_code, latencia)
+    return r
+
+def _latencia_no_comparable(url):
+    """
+    $batch (tarda según cuántas sub-peticiones lleva) y las descargas de contenido no
+    sirven de referencia de latencia para el control: solo cuentan su status.
+    """
+    path = url.split("?", 1)[0]
+    return path.endswith("/$batch") or path.endswith("/content")
+
+def estado_concurrencia():
+    """Límite actual, peticiones en vuelo y contadores del control adaptativo (None si está desactivado)."""
+    return _control.estado() if _control else None
+
+def _request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Ejecuta una petición a Graph con la sesión compartida.
+    Reintenta 429/502/503/504 y errores de conexión respetando Retry-After.
+    """
     if not TOKEN:
         raise RuntimeError("Falta GRAPH_TOKEN. Configúralo desde la UI (Configuración → Token de Graph…).")
-    r = requests.get(url, headers=HEADERS, timeout=30)
-    r.raise_for_status()
-    return r.json()
+    extra = kwargs.pop("headers", None)
+    headers = {**HEADERS, **extra} if extra else HEADERS
+    session = _get_session()
+    for intento in range(GRAPH_MAX_RETRIES + 1):
+        ultimo = intento >= GRAPH_MAX_RETRIES
+        try:
+            r = _enviar(session, method, url, headers, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if ultimo:
+                raise
+            time.sleep(_espera_reintento(intento))
+            continue
+        if r.status_code in _RETRY_STATUS and not ultimo:
+            r.close()
+            time.sleep(_espera_reintento(intento, r.headers.get("Retry-After")))
+            continue
+        if r.status_code == 401:
+            r.close()
+            raise TokenVencido("Acceso denegado (401): el token de Graph venció o no es válido.")
+        r.raise_for_status()
+        return r
+
+# === API Graph para SharePoint ===
+def _get(url: str):
+    return _request("GET", url).json()
 
 def get_site_drives(site_id):
     data = _get(f"{BASE}/sites/{site_id}/drives")
@@ -69,16 +264,99 @@ def get_list_id_from_drive(site_id, drive_id):
     data = _get(f"{BASE}/sites/{site_id}/drives/{drive_id}/list")
     return data["id"], data.get("name", "")
 
-def listar_items_por_factura(site_id, list_id, col_internal, factura):
+# === Caché de IDs de biblioteca/lista ===
+def _ids_cache_key():
+    return f"{SITE_ID}|{DRIVE_ID or LIB_PARTIAL_NAME}"
+
+def _leer_cache_ids() -> dict:
+    try:
+        with open(IDS_CACHE_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def _guardar_cache_ids(data: dict):
+    try:
+        with open(IDS_CACHE_PATH, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    except Exception:
+        pass  # best-effort
+
+def invalidar_cache_ids():
+    """Olvida los IDs guardados del sitio/biblioteca actual (se resuelven en la próxima búsqueda)."""
+    with _ids_lock:
+        data = _leer_cache_ids()
+        if data.pop(_ids_cache_key(), None) is not None:
+            _guardar_cache_ids(data)
+
+def _es_404(e) -> bool:
+    status = getattr(getattr(e, "response", None), "status_code", None) or getattr(e, "status", None)
+    return status == 404
+
+def _resolver_lista(refrescar=False):
     """
-    Devuelve todos los ítems donde fields/<col_internal> == factura.
+    Devuelve (list_id, drive_name, list_name, desde_cache) de la biblioteca configurada.
+    Usa la caché en disco mientras no venza IDS_CACHE_TTL_HORAS; refrescar=True la ignora.
     """
-    safe = str(factura).replace("'", "''")
-    filtro = f"fields/{col_internal} eq '{safe}'"
+    key = _ids_cache_key()
+    if not refrescar:
+        entrada = _leer_cache_ids().get(key)
+        if entrada and time.time() - entrada.get("ts", 0) < IDS_CACHE_TTL_HORAS * 3600:
+            return entrada["list_id"], entrada["drive_name"], entrada["list_name"], True
+
+    if DRIVE_ID:
+        drive_id, drive_name = DRIVE_ID, "(DRIVE_ID fijo)"
+    else:
+        drives = get_site_drives(SITE_ID)
+        drive_id, drive_name = pick_drive_id(drives, LIB_PARTIAL_NAME)
+        if not drive_id:
+            raise RuntimeError(f"No se encontró la biblioteca '{LIB_PARTIAL_NAME}'")
+    list_id, list_name = get_list_id_from_drive(SITE_ID, drive_id)
+
+    with _ids_lock:
+        data = _leer_cache_ids()
+        data[key] = {
+            "drive_id": drive_id, "drive_name": drive_name,
+            "list_id": list_id, "list_name": list_name, "ts": time.time(),
+        }
+        _guardar_cache_ids(data)
+    return list_id, drive_name, list_name, False
+
+def _filtro_carpeta(carpeta=True):
+    """Condición de $filter que limita a SUBCARPETA_SERVER_REL ('' si está desactivada)."""
+    if not (carpeta and _filtro_carpeta_activo):
+        return ""
+    safe = SUBCARPETA_SERVER_REL.replace("'", "''")
+    return f" and startswith(fields/FileDirRef, '{safe}')"
+
+def _desactivar_filtro_carpeta():
+    global _filtro_carpeta_activo
+    _filtro_carpeta_activo = False
+
+def _rechaza_filtro_carpeta(status, ruta):
+    """
+    True si un 400 puede deberse al filtro de carpeta (p. ej. FileDirRef sin indexar).
+    Solo es una sospecha: el filtro se desactiva si la misma consulta sin él funciona.
+    """
+    return status == 400 and "startswith(fields/FileDirRef" in ruta
+
+def _ruta_items(site_id, list_id, col_internal, filtro, top=200, carpeta=True):
+    """
+    Ruta relativa a BASE de una consulta filtrada de ítems (sirve para GET y $batch).
+    Añade el filtro de carpeta cuando está activo (y carpeta=True).
+    """
+    filtro += _filtro_carpeta(carpeta)
     select = f"fields($select=FileRef,FileDirRef,FileLeafRef,{col_internal})"
-    url = (f"{BASE}/sites/{site_id}/lists/{list_id}/items"
-           f"?$expand={select}&$filter={filtro}&$top=200")
+    return (f"/sites/{site_id}/lists/{list_id}/items"
+            f"?$expand={select}&$filter={filtro}&$top={top}")
+
+def _ruta_items_por_factura(site_id, list_id, col_internal, factura, carpeta=True):
+    """Ruta relativa a BASE de la consulta de ítems por factura."""
+    safe = str(factura).replace("'", "''")
+    return _ruta_items(site_id, list_id, col_internal, f"fields/{col_internal} eq '{safe}'", carpeta=carpeta)
 
+def _paginar(url):
+    """Todos los ítems de una consulta siguiendo @odata.nextLink."""
     items = []
     while url:
         data = _get(url)
@@ -86,11 +364,382 @@ def listar_items_por_factura(site_id, list_id, col_internal, factura):
         url = data.get("@odata.nextLink")
     return items
 
+def _consultar_items(site_id, list_id, col_internal, filtro, top=200):
+    """
+    _paginar de una consulta filtrada. Si Graph la rechaza con el filtro de carpeta,
+    la repite sin él (el cliente sigue filtrando); solo si así funciona se desactiva
+    el filtro para la sesión. Si también falla, el error es de la consulta en sí.
+    """
+    ruta = _ruta_items(site_id, list_id, col_internal, filtro, top)
+    try:
+        return _paginar(BASE + ruta)
+    except requests.HTTPError as e:
+        status = e.response.status_code if e.response is not None else None
+        if not _rechaza_filtro_carpeta(status, ruta):
+            raise
+    items = _paginar(BASE + _ruta_items(site_id, list_id, col_internal, filtro, top, carpeta=False))
+    _desactivar_filtro_carpeta()
+    return items
+
+def listar_items_por_factura(site_id, list_id, col_internal, factura):
+    """
+    Devuelve todos los ítems donde fields/<col_internal> == factura.
+    """
+    safe = str(factura).replace("'", "''")
+    return _consultar_items(site_id, list_id, col_internal, f"fields/{col_internal} eq '{safe}'")
+
+def _normalizar_factura(factura):
+    return str(factura).strip().upper()
+
+def _agrupar_rangos(facturas):
+    """
+    Agrupa las facturas PREFIJO+NÚMERO en rangos densos del mismo prefijo y número
+    de dígitos (así el orden de texto de Graph coincide con el numérico).
+    Devuelve (rangos, sueltas): [(desde, hasta, [facturas])] y las que no forman rango.
+    """
+    grupos, sueltas = {}, []
+    for fac in facturas:
+        m = re.fullmatch(r"(.*?)(\d+)", _normalizar_factura(fac))
+        if not m:
+            sueltas.append(fac)
+            continue
+        prefijo, digitos = m.groups()
+        grupos.setdefault((prefijo, len(digitos)), []).append((int(digitos), digitos, fac))
+
+    rangos = []
+    def cerrar(tramo, prefijo):
+        if len(tramo) >= RANGO_MIN_FACTURAS:
+            rangos.append((prefijo + tramo[0][1], prefijo + tramo[-1][1], [fac for _, _, fac in tramo]))
+        else:
+            sueltas.extend(fac for _, _, fac in tramo)
+
+    for (prefijo, _), numeros in grupos.items():
+        numeros.sort()
+        tramo = [numeros[0]]
+        for n in numeros[1:]:
+            if n[0] - tramo[-1][0] <= RANGO_MAX_HUECO and n[0] - tramo[0][0] <= RANGO_MAX_SPAN:
+                tramo.append(n)
+            else:
+                cerrar(tramo, prefijo)
+                tramo = [n]
+        cerrar(tramo, prefijo)
+    return rangos, sueltas
+
+def listar_items_por_rango(site_id, list_id, col_internal, desde, hasta):
+    """
+    Devuelve {factura normalizada: [ítems]} de todos los ítems con
+    desde <= fields/<col_internal> <= hasta (una consulta paginada).
+    Puede traer facturas que no se pidieron; se emparejan en local.
+    """
+    d, h = (str(v).replace("'", "''") for v in (desde, hasta))
+    filtro = f"fields/{col_internal} ge '{d}' and fields/{col_internal} le '{h}'"
+    por_factura = {}
+    for it in _consultar_items(site_id, list_id, col_internal, filtro, top=RANGO_PAGINA):
+        valor = (it.get("fields") or {}).get(col_internal)
+        if valor is not None:
+            por_factura.setdefault(_normalizar_factura(valor), []).append(it)
+    return por_factura
+
+class GraphBatchError(RuntimeError):
+    """Error de una sub-petición de /$batch (conserva el status HTTP)."""
+    def __init__(self, status, mensaje=""):
+        super().__init__(f"HTTP {status} en $batch {mensaje}".strip())
+        self.status = status
+
+def _post_batch(rutas):
+    """
+    Envía hasta GRAPH_BATCH_SIZE GET relativos en un solo POST a /$batch.
+    Devuelve las respuestas en el mismo orden que `rutas`.
+    """
+    body = {"requests": [
+        {"id": str(i), "method": "GET", "url": requests.utils.requote_uri(ruta)}
+        for i, ruta in enumerate(rutas)
+    ]}
+    data = _request("POST", f"{BASE}/$batch", json=body).json()
+    por_id = {r.get("id"): r for r in data.get("responses", [])}
+    return [por_id.get(str(i), {}) for i in range(len(rutas))]
+
+def listar_items_por_facturas_batch(site_id, list_id, col_internal, facturas):
+    """
+    Igual que listar_items_por_factura, pero empaqueta las consultas en /$batch.
+    Sigue los @odata.nextLink de cada sub-respuesta y reintenta las que vuelven
+    con 429/503 respetando su Retry-After.
+    Devuelve (items, errores): {factura: [ítems]} y {factura: Exception}.
+    """
+    items = {fac: [] for fac in facturas}
+    errores = {}
+    # (factura, ruta relativa, intentos)
+    pendientes = [(fac, _ruta_items_por_factura(site_id, list_id, col_internal, fac), 0) for fac in items]
+    sin_carpeta = set()  # facturas repetidas sin el filtro de carpeta tras un 400
+
+    while pendientes:
+        lote, pendientes = pendientes[:GRAPH_BATCH_SIZE], pendientes[GRAPH_BATCH_SIZE:]
+        respuestas = _post_batch([ruta for _, ruta, _ in lote])
+        espera = 0.0
+
+        for (fac, ruta, intentos), resp in zip(lote, respuestas):
+            status = resp.get("status")
+            body = resp.get("body") or {}
+            if status == 200:
+                if fac in sin_carpeta:
+                    # La consulta sin el filtro sí funciona: el 400 era por el filtro
+                    _desactivar_filtro_carpeta()
+                    sin_carpeta.discard(fac)
+                items[fac].extend(body.get("value", []))
+                siguiente = body.get("@odata.nextLink")
+                if siguiente:
+                    if siguiente.startswith(BASE):
+                        siguiente = siguiente[len(BASE):]
+                    pendientes.append((fac, siguiente, 0))
+            elif _rechaza_filtro_carpeta(status, ruta) and "$skiptoken" not in ruta:
+                # Primera página rechazada con el filtro de carpeta: se repite sin él
+                sin_carpeta.add(fac)
+                pendientes.append((fac, _ruta_items_por_factura(site_id, list_id, col_internal, fac, carpeta=False),
+                                   intentos))
+            elif status in _RETRY_STATUS and intentos < GRAPH_MAX_RETRIES:
+                if _control:
+                    _control.registrar(status)
+                headers = {k.lower(): v for k, v in (resp.get("headers") or {}).items()}
+                espera = max(espera, _espera_reintento(intentos, headers.get("retry-after")))
+                pendientes.append((fac, ruta, intentos + 1))
+            elif status == 401:
+                raise TokenVencido("Acceso denegado (401): el token de Graph venció o no es válido.")
+            else:
+                detalle = (body.get("error") or {}).get("message", "") if isinstance(body, dict) else ""
+                errores[fac] = GraphBatchError(status, detalle)
+
+        if espera:
+            time.sleep(espera)
+
+    for fac in errores:
+        items.pop(fac, None)
+    return items, errores
+
+# === Índice local (Graph delta → SQLite) ===
+def sincronizar_indice(list_id=None, on_progress=None, completo=False):
+    """
+    Recorre la lista de la biblioteca con la API delta y guarda
+    Factura → FileRef/FileDirRef/FileLeafRef/eTag en el índice local.
+    La primera vez (o con completo=True) lee toda la lista; después solo los cambios.
+    Devuelve el número de ítems aplicados.
+    """
+    if list_id is None:
+        list_id = _resolver_lista()[0]
+    indice = IndiceFacturas()
+
+    url = None if completo else indice.delta_link(list_id)
+    if url is None:
+        indice.limpiar(list_id)
+        select = f"fields($select=FileRef,FileDirRef,FileLeafRef,{COLUMNA_FACTURA_INTERNAL})"
+        url = f"{BASE}/sites/{SITE_ID}/lists/{list_id}/items/delta?$expand={select}"
+
+    aplicados, delta_link = 0, None
+    while url:
+        try:
+            data = _get(url)
+        except requests.HTTPError as e:
+            # deltaLink caducado: Graph pide resincronizar desde cero
+            if not completo and e.response is not None and e.response.status_code == 410:
+                return sincronizar_indice(list_id, on_progress, completo=True)
+            raise
+        aplicados += indice.aplicar(list_id, COLUMNA_FACTURA_INTERNAL, data.get("value", []))
+        if on_progress:
+            on_progress(f"Índice: {aplicados} cambios aplicados…")
+        url = data.get("@odata.nextLink")
+        delta_link = data.get("@odata.deltaLink") or delta_link
+
+    if delta_link:
+        indice.guardar_delta(list_id, delta_link)
+    if on_progress:
+        on_progress(f"Índice sincronizado: {indice.total(list_id)} ítems.")
+    return aplicados
+
+def _buscar_en_indice(list_id, facturas, on_progress=None):
+    """
+    Trae los cambios pendientes del índice y devuelve {factura: [ítems]} de las
+    facturas que tienen un archivo en SUBCARPETA_SERVER_REL. Vacío si no hay índice.
+    """
+    indice = IndiceFacturas()
+    if not indice.sincronizado(list_id):
+        return {}
+    try:
+        sincronizar_indice(list_id)
+    except Exception as e:
+        if on_progress:
+            on_progress(f"Índice: no se pudo actualizar ({e}); se usa la copia local.")
+    encontrados = indice.buscar(list_id, COLUMNA_FACTURA_INTERNAL, facturas)
+    return {fac: items for fac, items in encontrados.items() if _en_subcarpeta(items)}
+
+# === Caché de consultas por factura ===
+def _get_cache_consultas() -> CacheConsultas:
+    global _cache_consultas
+    if _cache_consultas is None:
+        with _en_vuelo_lock:
+            if _cache_consultas is None:
+                _cache_consultas = CacheConsultas()
+    return _cache_consultas
+
+def _clave_consulta(list_id, factura):
+    return (SITE_ID, list_id, COLUMNA_FACTURA_INTERNAL, _normalizar_factura(factura))
+
+def _consultas_en_cache(list_id, facturas):
+    """{factura: ítems} de las facturas con una consulta vigente en caché (vacía = negativa)."""
+    claves = {}
+    for fac in facturas:
+        claves.setdefault(_clave_consulta(list_id, fac), []).append(fac)
+    vigentes = _get_cache_consultas().obtener(
+        claves, CACHE_CONSULTAS_TTL_HORAS * 3600, CACHE_NEGATIVOS_TTL_MIN * 60
+    )
+    return {fac: items for clave, items in vigentes.items() for fac in claves[clave]}
+
+def _guardar_consultas(list_id, resultados):
+    if resultados:
+        _get_cache_consultas().guardar(
+            {_clave_consulta(list_id, fac): items for fac, items in resultados.items()}
+        )
+
+def listar_items_cacheado(list_id, factura, leer=True):
+    """
+    listar_items_por_factura con caché (positivos y negativos) y single-flight:
+    si otra consulta por la misma factura ya está en vuelo, se espera su resultado
+    en lugar de repetirla. leer=False ignora la caché pero guarda el resultado.
+    """
+    if leer:
+        en_cache = _consultas_en_cache(list_id, [factura])
+        if factura in en_cache:
+            return en_cache[factura]
+
+    clave = _clave_consulta(list_id, factura)
+    with _en_vuelo_lock:
+        futuro = _en_vuelo.get(clave)
+        lider = futuro is None
+        if lider:
+            futuro = _en_vuelo[clave] = Future()
+    if not lider:
+        return futuro.result()
+
+    try:
+        items = listar_items_por_factura(SITE_ID, list_id, COLUMNA_FACTURA_INTERNAL, factura)
+        _guardar_consultas(list_id, {factura: items})
+        futuro.set_result(items)
+        return items
+    except BaseException as e:
+        futuro.set_exception(e)
+        raise
+    finally:
+        with _en_vuelo_lock:
+            _en_vuelo.pop(clave, None)
+
+# === Descarga directa desde Graph ===
+def descargar_contenido(url, destino, chunk_size=None):
+    """
+    Descarga `url` a `destino` en bloques de `chunk_size` (memoria acotada; por
+    defecto DESCARGA_CHUNK).
+    Escribe en <destino>.descarga; si la conexión se corta, reanuda con Range desde
+    lo ya escrito, con If-Range y el ETag de la primera respuesta para no mezclar
+    versiones del archivo. Devuelve la ruta de destino.
+    """
+    destino = Path(destino)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    parcial = destino.with_name(destino.name + ".descarga")
+    chunk_size = chunk_size or DESCARGA_CHUNK
+    # Un parcial de una llamada anterior no se puede validar: se empieza de cero
+    parcial.unlink(missing_ok=True)
+    etag = total = None
+    for intento in range(GRAPH_MAX_RETRIES + 1):
+        inicio = parcial.stat().st_size if parcial.exists() else 0
+        headers = None
+        if inicio:
+            headers = {"Range": f"bytes={inicio}-"}
+            if etag:
+                headers["If-Range"] = etag
+        try:
+            with _request("GET", url, headers=headers, stream=True) as r:
+                if inicio and not _rango_reanudable(r, inicio, total):
+                    if r.status_code == 206:
+                        # Un trozo que no encaja con lo escrito: se descarta todo y se pide entero
+                        parcial.unlink(missing_ok=True)
+                        continue
+                    inicio = 0  # el servidor ignoró Range o el archivo cambió (If-Range): de cero
+                if not inicio:
+                    etag = _etag_fuerte(r.headers.get("ETag"))
+                    # Con Content-Encoding, Content-Length no es el tamaño de lo que se escribe
+                    total = None if r.headers.get("Content-Encoding") else _int_o_none(r.headers.get("Content-Length"))
+                with open(parcial, "ab" if inicio else "wb") as f:
+                    for bloque in r.iter_content(chunk_size):
+                        f.write(bloque)
+            if total is not None and parcial.stat().st_size != total:
+                raise requests.exceptions.ChunkedEncodingError(
+                    f"Descarga incompleta: {parcial.stat().st_size} de {total} bytes")
+            os.replace(parcial, destino)
+            return destino
+        except requests.HTTPError as e:
+            # 416: lo parcial no cuadra con el archivo actual; se descarta
+            if inicio and e.response is not None and e.response.status_code == 416 and intento < GRAPH_MAX_RETRIES:
+                parcial.unlink(missing_ok=True)
+                continue
+            raise
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+            if intento >= GRAPH_MAX_RETRIES:
+                raise
+            time.sleep(_espera_reintento(intento))
+
+def _etag_fuerte(etag):
+    """ETag utilizable en If-Range (los débiles, W/..., no valen para rangos)."""
+    return etag if etag and not etag.startswith("W/") else None
+
+def _int_o_none(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+def _rango_reanudable(r, inicio, total):
+    """True si `r` es el 206 que continúa desde `inicio` el mismo archivo de `total` bytes."""
+    if r.status_code != 206:
+        return False
+    # Content-Range: bytes <desde>-<hasta>/<total>
+    m = re.fullmatch(r"bytes (\d+)-\d+/(\d+|\*)", (r.headers.get("Content-Range") or "").strip())
+    if not m or int(m.group(1)) != inicio:
+        return False
+    return total is None or m.group(2) == "*" or int(m.group(2)) == total
+
+def _url_contenido(list_id, item_id):
+    return f"{BASE}/sites/{SITE_ID}/lists/{list_id}/items/{item_id}/driveItem/content"
+
 # === Copia local desde OneDrive sincronizado ===
+def _get_indice_archivos() -> IndiceArchivos:
+    """Índice compartido por todas las facturas (y entre ejecuciones, vía caché en disco)."""
+    global _indice_archivos
+    if _indice_archivos is None:
+        with _indice_archivos_lock:
+            if _indice_archivos is None:
+                _indice_archivos = IndiceArchivos(ONEDRIVE_BASES, ARCHIVOS_CACHE_PATH)
+    return _indice_archivos
+
 def descargar_archivo(file_ref, nombre_archivo, factura=None):
     """
     Copia desde las carpetas locales de OneDrive (ONEDRIVE_BASES) a la carpeta Facturas_descargadas.
     Soporta varias carpetas configuradas en ONEDRIVE_BASE separadas por ';'.
+    La carpeta de `file_ref` en SharePoint decide entre archivos locales con el mismo nombre.
+    """
+    dir_ref = file_ref.rsplit("/", 1)[0] if file_ref and "/" in file_ref else None
+    archivo_local = _localizar_archivo(nombre_archivo, dir_ref)
+    nombre_destino = f"{factura}.pdf" if factura else nombre_archivo
+    return _copiar_a_descargas(archivo_local, nombre_destino)[0]
+
+def _carpeta_en_biblioteca(dir_ref):
+    """FileDirRef relativo a la biblioteca ('/sites/X/Biblioteca/FANALCA/2024' → 'FANALCA/2024')."""
+    dir_ref = (dir_ref or "").rstrip("/")
+    biblioteca = SUBCARPETA_SERVER_REL.rsplit("/", 1)[0]
+    if dir_ref.startswith(biblioteca + "/"):
+        return dir_ref[len(biblioteca) + 1:]
+    return dir_ref.lstrip("/") or None
+
+def _localizar_archivo(nombre_archivo, dir_ref=None):
+    """
+    Ruta local de `nombre_archivo` en ONEDRIVE_BASES (o sus subcarpetas); error si no está.
+    Si hay varios archivos con ese nombre, `dir_ref` (FileDirRef del ítem) elige la carpeta.
     """
     # Validar que al menos una base exista
     bases_existentes = [b for b in ONEDRIVE_BASES if b.exists()]
@@ -103,97 +752,527 @@ def descargar_archivo(file_ref, nombre_archivo, factura=None):
             "ruta(s) local(es) correcta(s). Puedes poner varias separadas por ';'."
         )
 
-    # Destino (carpeta estable junto al ejecutable)
-    carpeta_descargas = BASE_DIR / "Facturas_descargadas"
-    carpeta_descargas.mkdir(parents=True, exist_ok=True)
-
-    nombre_destino = f"{factura}.pdf" if factura else nombre_archivo
-    destino = carpeta_descargas / nombre_destino
-
-    # Buscar el archivo en cualquiera de las bases
-    archivo_local = None
-    for base in bases_existentes:
-        candidato = base / nombre_archivo
-        if candidato.exists():
-            archivo_local = candidato
-            break
+    # Buscar el archivo en cualquiera de las bases (o sus subcarpetas)
+    indice = _get_indice_archivos()
+    archivo_local = indice.buscar(nombre_archivo, _carpeta_en_biblioteca(dir_ref))
 
     if not archivo_local:
+        candidatos = indice.candidatos(nombre_archivo)
+        if len(candidatos) > 1:
+            rutas_txt = "\n".join(str(c) for c in candidatos)
+            raise FileNotFoundError(
+                f"Hay {len(candidatos)} archivos '{nombre_archivo}' en las carpetas configuradas y "
+                f"ninguno corresponde a la carpeta de SharePoint '{dir_ref}':\n{rutas_txt}"
+            )
         rutas_txt = "\n".join(str(b) for b in bases_existentes)
         raise FileNotFoundError(
             f"No se encontró el archivo '{nombre_archivo}' en ninguna de las carpetas configuradas.\n\n"
-            f"Carpetas buscadas:\n{rutas_txt}\n\n"
+            f"Carpetas buscadas (con subcarpetas):\n{rutas_txt}\n\n"
             "• Verifica que ONEDRIVE_BASE incluya todas las carpetas donde se sincronizan las facturas\n"
             "  (por ejemplo: ...\\FANALCA;...\\FANALCA_2025).\n"
             "• Asegúrate de que el PDF esté sincronizado (clic derecho → 'Siempre mantener en este dispositivo')."
         )
 
-    shutil.copy2(archivo_local, destino)
-    return destino
+    return archivo_local
+
+def _copiar_a_descargas(archivo_local, nombre_destino):
+    """
+    Copia un PDF local a Facturas_descargadas (carpeta estable junto al ejecutable).
+    Devuelve (destino, accion, bytes escritos); en modo incremental un PDF idéntico
+    no se reescribe y un enlace no escribe datos.
+    """
+    carpeta_descargas = BASE_DIR / "Facturas_descargadas"
+    carpeta_descargas.mkdir(parents=True, exist_ok=True)
+    destino = carpeta_descargas / nombre_destino
+    if not COPIA_INCREMENTAL:
+        shutil.copy2(archivo_local, destino)
+        return destino, COPIADO, destino.stat().st_size
+    return (destino, *copiar_si_cambio(archivo_local, destino, COPIA_ENLACE, COPIA_VERIFICAR_HASH))
+
+def _mensaje_copia(destino, accion):
+    if accion == SIN_CAMBIOS:
+        return f"[LOCAL] Sin cambios → {destino.name}"
+    if accion != COPIADO:
+        return f"[LOCAL] Enlazado ({accion}) → {destino.name}"
+    return f"[LOCAL] Copiado → {destino.name}"
+
+# === Canal de progreso ===
+class CanalProgreso:
+    """
+    Receptor compatible con on_progress que no despacha nada por mensaje:
+    guarda el último texto y acumula contadores bajo un lock. La UI lo lee
+    a ritmo fijo con snapshot() en lugar de recibir un evento por mensaje.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mensaje = ""
+        self._version = 0
+        self._inicio = time.monotonic()
+        self.contadores = {"encontradas": 0, "no_encontradas": 0, "copiadas": 0, "errores": 0}
+
+    def __call__(self, msg: str):
+        with self._lock:
+            self._mensaje = msg
+            self._version += 1
+
+    def contar(self, **deltas):
+        with self._lock:
+            for k, v in deltas.items():
+                self.contadores[k] = self.contadores.get(k, 0) + v
+            self._version += 1
+
+    def snapshot(self):
+        """Devuelve (version, texto); la versión solo cambia si hubo novedades."""
+        with self._lock:
+            version, mensaje, c = self._version, self._mensaje, dict(self.contadores)
+        procesadas = c["encontradas"] + c["no_encontradas"]
+        if not procesadas:
+            return version, mensaje
+        ritmo = procesadas / max(time.monotonic() - self._inicio, 1e-6)
+        resumen = (f"Encontradas: {c['encontradas']} · No encontradas: {c['no_encontradas']} · "
+                   f"Copiadas: {c['copiadas']} · Errores: {c['errores']} · {ritmo:.1f} fact/s")
+        return version, f"{mensaje}\n{resumen}"
 
 # === Flujo principal de búsqueda ===
-def buscar(facturas, on_progress=None):
+def _en_subcarpeta(items):
+    """
+    Ítems bajo SUBCARPETA_SERVER_REL. Se sigue filtrando en el cliente: el índice
+    local, la caché y las consultas sin filtro de carpeta traen todas las carpetas.
+    """
+    return [
+        it for it in items
+        if ((it.get("fields", {}).get("FileDirRef") or "").startswith(SUBCARPETA_SERVER_REL))
+    ]
+
+class _EtapaCopia:
+    """
+    Pool de E/S para las copias locales, alimentado a medida que llegan los hits.
+    Así las copias (lentas en carpetas sincronizadas) se solapan con las consultas
+    a Graph. Lleva la cuenta de bytes escritos (las funciones encoladas los informan
+    con `al_escribir`) para reportar velocidad y ETA.
+    """
+
+    def __init__(self, workers):
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        self._lock = threading.Lock()
+        self.programadas = self.hechas = self.bytes = 0
+        self.inicio = time.monotonic()
+
+    def enviar(self, fn, *args) -> Future:
+        with self._lock:
+            self.programadas += 1
+        return self.pool.submit(self._ejecutar, fn, *args)
+
+    def _ejecutar(self, fn, *args):
+        try:
+            return fn(*args, al_escribir=self._sumar_bytes)
+        finally:
+            with self._lock:
+                self.hechas += 1
+
+    def _sumar_bytes(self, n):
+        with self._lock:
+            self.bytes += n
+
+    def resumen(self) -> str:
+        with self._lock:
+            programadas, hechas, total_bytes = self.programadas, self.hechas, self.bytes
+        segundos = max(time.monotonic() - self.inicio, 1e-6)
+        velocidad = total_bytes / segundos
+        texto = (f"Copias: {hechas}/{programadas} · {total_bytes / 1e6:.1f} MB · "
+                 f"{velocidad / 1e6:.1f} MB/s")
+        pendientes = programadas - hechas
+        if pendientes and hechas and velocidad > 0:
+            eta = pendientes * (total_bytes / hechas) / velocidad
+            texto += f" · ETA {eta:.0f} s"
+        return texto
+
+    def cerrar(self):
+        self.pool.shutdown(wait=True)
+
+def _copiar_hit(fac, items, etapa=None, list_id=None):
+    """
+    Filtra los ítems a SUBCARPETA_SERVER_REL y copia el primer PDF.
+    Devuelve (encontrada, destino, mensajes, error) sin tocar estado compartido,
+    así buscar() puede agregar los resultados en el orden original.
+    Con `etapa` la copia se encola en su pool y se devuelve un Future.
+    Con `list_id`, si el PDF no está en local se descarga de Graph.
+    """
+    hits = _en_subcarpeta(items)
+    if not hits:
+        return False, None, [f"{fac}: no encontrada"], False
+
+    file_name = hits[0]["fields"]["FileLeafRef"]
+    dir_ref = hits[0]["fields"].get("FileDirRef")
+    item_id = hits[0].get("id")
+    url = _url_contenido(list_id, item_id) if (DESCARGA_GRAPH and list_id and item_id) else None
+    if etapa is not None:
+        return etapa.enviar(_copiar_nombre, fac, file_name, url, dir_ref)
+    return _copiar_nombre(fac, file_name, url, dir_ref)
+
+def _copiar_nombre(fac, file_name, url_contenido=None, dir_ref=None, al_escribir=None):
+    """
+    Localiza `file_name` (en la carpeta que corresponde a `dir_ref`) en las carpetas de
+    OneDrive y lo copia como <factura>.pdf. Si no está (no hay carpetas, es ambiguo o
+    la copia falla, p. ej. un marcador solo en la nube) y hay `url_contenido`, lo
+    descarga de Graph. al_escribir(bytes) recibe lo escrito.
+    """
+    try:
+        try:
+            archivo_local = _localizar_archivo(file_name, dir_ref)
+            # Un marcador de OneDrive solo en la nube figura en el índice, pero copiarlo
+            # falla (OSError) si el cliente de sincronización no lo puede traer
+            destino, accion, escritos = _copiar_a_descargas(archivo_local, f"{fac}.pdf")
+        except (OSError, RuntimeError) as e:
+            if not url_contenido:
+                raise
+            try:
+                destino = descargar_contenido(url_contenido, BASE_DIR / "Facturas_descargadas" / f"{fac}.pdf")
+            except Exception as e_graph:
+                raise RuntimeError(f"{e}\n\nDescarga desde SharePoint fallida: {e_graph}") from e_graph
+            if al_escribir:
+                al_escribir(destino.stat().st_size)
+            return True, destino, [f"[GRAPH] Descargado → {destino.name}"], False
+        if al_escribir:
+            al_escribir(escritos)
+        return True, destino, [_mensaje_copia(destino, accion)], False
+    except Exception as e:
+        return True, None, [f"{fac}: Error al copiar local ({e})"], True
+
+def _copiar_local(fac, archivo_local, al_escribir=None):
+    """Copia un PDF resuelto por nombre en las carpetas locales (modo local primero)."""
+    try:
+        destino, accion, escritos = _copiar_a_descargas(archivo_local, f"{fac}.pdf")
+        if al_escribir:
+            al_escribir(escritos)
+        return True, destino, [_mensaje_copia(destino, accion)], False
+    except Exception as e:
+        return True, None, [f"{fac}: Error al copiar local ({e})"], True
+
+def _buscar_locales(facturas):
+    """
+    {factura: ruta} de las facturas cuyo PDF local se llama como la factura.
+    Si hay varios PDFs con esa clave, solo vale el único bajo la carpeta local de
+    SUBCARPETA_SERVER_REL; si no, la factura queda para SharePoint.
+    """
+    indice = _get_indice_archivos()
+    indice.actualizar()
+    carpeta = _carpeta_en_biblioteca(SUBCARPETA_SERVER_REL)
+    locales = {}
+    for fac in facturas:
+        ruta = indice.buscar_factura(fac, refrescar=False, carpeta=carpeta)
+        if ruta is not None:
+            locales[fac] = ruta
+    return locales
+
+def _resolver_factura(fac, list_id, etapa=None, leer_cache=True):
+    """Busca una factura con una consulta propia (o la caché) y copia su PDF."""
+    try:
+        items = listar_items_cacheado(list_id, fac, leer=leer_cache)
+    except TokenVencido:
+        raise
+    except Exception as e:
+        if _es_404(e):
+            invalidar_cache_ids()
+        return False, None, [f"{fac}: error ({e})"], True
+    return _copiar_hit(fac, items, etapa, list_id)
+
+def _resolver_lote(facs, list_id, etapa=None):
+    """Busca un grupo de facturas con $batch y copia sus PDFs. Devuelve {factura: resultado}."""
+    try:
+        items, errores = listar_items_por_facturas_batch(SITE_ID, list_id, COLUMNA_FACTURA_INTERNAL, facs)
+    except TokenVencido:
+        raise
+    except Exception as e:
+        if _es_404(e):
+            invalidar_cache_ids()
+        return {fac: (False, None, [f"{fac}: error ({e})"], True) for fac in facs}
+
+    if any(_es_404(err) for err in errores.values()):
+        invalidar_cache_ids()
+    _guardar_consultas(list_id, items)
+    resultados = {fac: (False, None, [f"{fac}: error ({err})"], True) for fac, err in errores.items()}
+    for fac, its in items.items():
+        resultados[fac] = _copiar_hit(fac, its, etapa, list_id)
+    return resultados
+
+def _resolver_rango(desde, hasta, facs, list_id, etapa=None):
+    """
+    Busca un rango de facturas con una sola consulta ge/le y copia sus PDFs.
+    Si Graph rechaza el filtro (p. ej. columna sin indexar) recurre a $batch.
+    Devuelve {factura: resultado}.
+    """
+    try:
+        por_factura = listar_items_por_rango(SITE_ID, list_id, COLUMNA_FACTURA_INTERNAL, desde, hasta)
+    except TokenVencido:
+        raise
+    except Exception as e:
+        if _es_404(e):
+            invalidar_cache_ids()
+            return {fac: (False, None, [f"{fac}: error ({e})"], True) for fac in facs}
+        resultados = {}
+        for k in range(0, len(facs), GRAPH_BATCH_SIZE):
+            resultados.update(_resolver_lote(facs[k:k + GRAPH_BATCH_SIZE], list_id, etapa))
+        return resultados
+
+    items = {fac: por_factura.get(_normalizar_factura(fac), []) for fac in facs}
+    _guardar_consultas(list_id, items)
+    return {fac: _copiar_hit(fac, its, etapa, list_id) for fac, its in items.items()}
+
+def _preparar_graph(facturas, on_progress, indice, refrescar_ids, cache=True):
+    """
+    Resuelve biblioteca/lista y adelanta lo que no requiere una consulta por factura.
+    Devuelve (list_id, precargadas, pendientes): {factura: ítems} ya conocidos
+    y las facturas que aún hay que consultar en Graph.
+    """
     if on_progress:
         on_progress("Conectando a SharePoint…")
 
     # Biblioteca y lista
-    if DRIVE_ID:
-        drive_id, drive_name = DRIVE_ID, "(DRIVE_ID fijo)"
-    else:
-        drives = get_site_drives(SITE_ID)
-        drive_id, drive_name = pick_drive_id(drives, LIB_PARTIAL_NAME)
-        if not drive_id:
-            raise RuntimeError(f"No se encontró la biblioteca '{LIB_PARTIAL_NAME}'")
-    list_id, list_name = get_list_id_from_drive(SITE_ID, drive_id)
+    list_id, drive_name, list_name, desde_cache = _resolver_lista(refrescar=refrescar_ids)
 
     if on_progress:
         on_progress(f"📁 Biblioteca: {drive_name} | Lista: {list_name}")
 
+    precargadas = _buscar_en_indice(list_id, facturas, on_progress) if indice else {}
+    if precargadas and on_progress:
+        on_progress(f"Índice local: {len(precargadas)}/{len(facturas)} facturas resueltas sin consultar Graph.")
+    pendientes = [fac for fac in facturas if fac not in precargadas]
+
+    if cache and pendientes:
+        en_cache = _consultas_en_cache(list_id, pendientes)
+        if en_cache:
+            precargadas.update(en_cache)
+            pendientes = [fac for fac in pendientes if fac not in en_cache]
+            if on_progress:
+                on_progress(f"Caché de consultas: {len(en_cache)} facturas sin volver a consultar Graph.")
+
+    # Con IDs de caché, la primera consulta sirve de validación: si la lista
+    # ya no existe (404) se resuelven de nuevo antes de lanzar el resto.
+    if desde_cache and pendientes:
+        primera = pendientes[0]
+        try:
+            precargadas[primera] = listar_items_cacheado(list_id, primera, leer=False)
+            pendientes = pendientes[1:]
+        except TokenVencido:
+            raise
+        except Exception as e:
+            # Otros errores se reportan por factura en el flujo normal
+            if _es_404(e):
+                invalidar_cache_ids()
+                if on_progress:
+                    on_progress("IDs de biblioteca en caché obsoletos; resolviendo de nuevo…")
+                list_id = _resolver_lista(refrescar=True)[0]
+
+    return list_id, precargadas, pendientes
+
+def _resultado_de(futuro, fac):
+    """
+    Desenvuelve el resultado de una factura: los futuros de consulta devuelven
+    {factura: resultado} y el resultado puede ser a su vez el Future de su copia.
+    """
+    res = futuro.result()
+    if isinstance(res, dict):
+        res = res[fac]
+    if isinstance(res, Future):
+        res = res.result()
+    return res
+
+def _al_resolver(futuro, fac, fn):
+    """Llama fn(factura, resultado) en cuanto el resultado está listo (ver _resultado_de)."""
+    def listo(f):
+        try:
+            res = f.result()
+        except Exception:
+            return  # errores y cancelaciones no se anotan
+        if isinstance(res, dict):
+            res = res[fac]
+        if isinstance(res, Future):
+            _al_resolver(res, fac, fn)
+        else:
+            fn(fac, res)
+    futuro.add_done_callback(listo)
+
+def _completado(fac, resultado):
+    futuro = Future()
+    futuro.set_result({fac: resultado})
+    return futuro
+
+def buscar(facturas, on_progress=None, workers=None, batch=False, indice=True, refrescar_ids=False,
+           local_primero=None, copia_workers=None, cache=True, rangos=None, diario=None):
+    """
+    Busca las facturas en SharePoint y copia los PDFs encontrados.
+    workers: facturas resueltas en paralelo (por defecto BUSCAR_WORKERS, o GRAPH_CONCURRENCIA_MAX
+             con concurrencia adaptativa: el control decide cuántas consultas van en vuelo).
+    copia_workers: hilos de E/S de la etapa de copia (por defecto COPIA_WORKERS).
+    cache: reutiliza consultas recientes por factura (CACHE_CONSULTAS_TTL_HORAS para las
+           encontradas, CACHE_NEGATIVOS_TTL_MIN para las que no dieron resultado; 0 por
+           defecto, así una factura que faltaba se vuelve a consultar en cada búsqueda).
+    on_progress: callable(str); si además tiene contar(**deltas) (p. ej. CanalProgreso)
+                 recibe por factura los contadores encontradas/no_encontradas/copiadas/errores.
+    batch: agrupa las consultas en POST a /$batch de GRAPH_BATCH_SIZE facturas.
+    rangos: pide las series consecutivas (PREFIJO+NÚMERO) con una consulta ge/le por rango
+            y empareja en local (por defecto BUSCAR_RANGOS); las sueltas van por batch o una a una.
+    indice: resuelve primero con el índice local (si ya fue sincronizado) y
+            consulta Graph solo las facturas que no estén en él.
+    refrescar_ids: ignora la caché de IDs de biblioteca/lista y los vuelve a consultar.
+    local_primero: resuelve por nombre de archivo en ONEDRIVE_BASES y consulta SharePoint
+                   solo las restantes (por defecto BUSCAR_LOCAL_PRIMERO). Si SharePoint no
+                   está disponible, las restantes se reportan con error sin perder las locales.
+    diario: anota cada resultado en DIARIOS_DIR (por defecto BUSCAR_DIARIO). Si una búsqueda
+            con las mismas facturas quedó a medias, se retoma: las ya resueltas sin error no
+            se vuelven a buscar. El diario solo se conserva si la búsqueda se corta (excepción
+            o TokenVencido) y caduca a las DIARIO_MAX_HORAS. Un 401 de Graph corta la búsqueda
+            con TokenVencido; tras set_graph_token basta con repetirla.
+    Los mensajes de progreso y las listas de resultado conservan el orden de `facturas`.
+    """
+    local_primero = BUSCAR_LOCAL_PRIMERO if local_primero is None else local_primero
+    rangos = BUSCAR_RANGOS if rangos is None else rangos
+    diario = BUSCAR_DIARIO if diario is None else diario
+    contar = getattr(on_progress, "contar", None)  # CanalProgreso u otro receptor con contadores
     total = len(facturas)
     encontradas, no_encontradas, descargadas = [], [], []
 
-    #Iterar facturas
-    for i, fac in enumerate(facturas, start=1):
-        if on_progress:
-            on_progress(f"Buscando {i}/{total}: {fac}")
+    if workers is None:
+        workers = GRAPH_CONCURRENCIA_MAX if _control else BUSCAR_WORKERS
+    workers = max(1, int(workers))
+    if workers > GRAPH_POOL_SIZE:
+        set_pool_size(workers)
+
+    # Las facturas repetidas se resuelven una sola vez
+    unicas = list(dict.fromkeys(facturas))
+
+    # Resultados de una ejecución anterior interrumpida con las mismas facturas
+    diario_busqueda, previas = None, {}
+    if diario:
+        diario_busqueda = DiarioBusqueda(DIARIOS_DIR / f"{id_trabajo(unicas)}.jsonl", unicas,
+                                         DIARIO_MAX_HORAS * 3600)
+        previas = diario_busqueda.completadas()
+        if previas and on_progress:
+            on_progress(f"Reanudando búsqueda: {len(previas)}/{len(unicas)} facturas ya resueltas.")
+    por_resolver = [fac for fac in unicas if fac not in previas]
+
+    locales = _buscar_locales(por_resolver) if local_primero else {}
+    if local_primero and on_progress:
+        on_progress(f"Carpetas locales: {len(locales)}/{len(por_resolver)} facturas resueltas sin consultar SharePoint.")
+    restantes = [fac for fac in por_resolver if fac not in locales]
 
+    list_id, precargadas, pendientes, error_graph = None, {}, [], None
+    if restantes:
         try:
-            items = listar_items_por_factura(SITE_ID, list_id, COLUMNA_FACTURA_INTERNAL, fac)
-            hits = [
-                it for it in items
-                if (it.get("fields", {}).get("FileDirRef", "").startswith(SUBCARPETA_SERVER_REL))
-            ]
-
-            if hits:
-                encontradas.append(fac)
-                try:
-                    file_ref = hits[0]["fields"]["FileRef"]
-                    file_name = hits[0]["fields"]["FileLeafRef"]
-                    destino = descargar_archivo(file_ref, file_name, factura=fac)
-                    descargadas.append(str(destino))
-                    if on_progress:
-                        on_progress(f"[LOCAL] Copiado → {destino.name}")
-                except Exception as e:
-                    if on_progress:
-                        on_progress(f"{fac}: Error al copiar local ({e})")
+            list_id, precargadas, pendientes = _preparar_graph(restantes, on_progress, indice, refrescar_ids, cache)
+        except Exception as e:
+            if not locales and not previas:
+                if diario_busqueda:
+                    diario_busqueda.cerrar()
+                raise
+            error_graph = e
+            if on_progress:
+                on_progress(f"SharePoint no disponible ({e}); {len(restantes)} facturas quedan sin resolver.")
+
+    # Cada futuro de consulta devuelve {factura: (encontrada, destino, mensajes, error)}
+    # o {factura: Future} cuando la copia quedó encolada en la etapa de E/S.
+    etapa = _EtapaCopia(COPIA_WORKERS if copia_workers is None else copia_workers)
+    ultimo_reporte = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futuros = {fac: _completado(fac, res) for fac, res in previas.items()}
+            futuros.update({fac: etapa.enviar(_copiar_local, fac, ruta) for fac, ruta in locales.items()})
+            futuros.update({
+                fac: pool.submit(lambda f, its: {f: _copiar_hit(f, its, etapa, list_id)}, fac, items)
+                for fac, items in precargadas.items()
+            })
+            if error_graph is not None:
+                sin_resolver = {fac: (False, None, [f"{fac}: error ({error_graph})"], True) for fac in restantes}
+                futuros.update({fac: pool.submit(lambda: sin_resolver) for fac in restantes})
             else:
-                no_encontradas.append(fac)
+                sueltas = pendientes
+                if rangos:
+                    grupos_rango, sueltas = _agrupar_rangos(pendientes)
+                    for desde, hasta, grupo in grupos_rango:
+                        fut = pool.submit(_resolver_rango, desde, hasta, grupo, list_id, etapa)
+                        futuros.update({fac: fut for fac in grupo})
+                    if grupos_rango and on_progress:
+                        on_progress(f"Rangos: {len(pendientes) - len(sueltas)} facturas "
+                                    f"en {len(grupos_rango)} consultas por rango.")
+                if batch:
+                    for k in range(0, len(sueltas), GRAPH_BATCH_SIZE):
+                        grupo = sueltas[k:k + GRAPH_BATCH_SIZE]
+                        fut = pool.submit(_resolver_lote, grupo, list_id, etapa)
+                        futuros.update({fac: fut for fac in grupo})
+                else:
+                    for fac in sueltas:
+                        futuros[fac] = pool.submit(lambda f: {f: _resolver_factura(f, list_id, etapa, cache)}, fac)
+
+            if diario_busqueda:
+                for fac in por_resolver:
+                    _al_resolver(futuros[fac], fac, diario_busqueda.registrar)
+
+            for i, fac in enumerate(facturas, start=1):
                 if on_progress:
-                    on_progress(f"{fac}: no encontrada")
+                    on_progress(f"Buscando {i}/{total}: {fac}")
 
-        except Exception as e:
-            no_encontradas.append(fac)
-            if on_progress:
-                on_progress(f"{fac}: error ({e})")
+                try:
+                    encontrada, destino, mensajes, error = _resultado_de(futuros[fac], fac)
+                except TokenVencido:
+                    # Lo ya resuelto queda en el diario; el resto se descarta
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    raise
+                if encontrada:
+                    encontradas.append(fac)
+                    if destino is not None:
+                        descargadas.append(str(destino))
+                else:
+                    no_encontradas.append(fac)
+
+                if contar:
+                    contar(
+                        encontradas=int(encontrada), no_encontradas=int(not encontrada),
+                        copiadas=int(destino is not None), errores=int(error),
+                    )
+                if on_progress:
+                    for msg in mensajes:
+                        on_progress(msg)
+                    if time.monotonic() - ultimo_reporte >= 1.0:
+                        ultimo_reporte = time.monotonic()
+                        on_progress(etapa.resumen())
+    finally:
+        etapa.cerrar()
+        if diario_busqueda:
+            diario_busqueda.cerrar()
 
+    if on_progress and etapa.programadas:
+        on_progress(etapa.resumen())
+    if on_progress and _control and _control.exitos:
+        e = _control.estado()
+        on_progress(f"Concurrencia Graph: límite {e['limite']}, {e['throttles']} throttles, {e['errores']} errores.")
     if on_progress:
         on_progress(
             f"Finalizado: {len(encontradas)} encontradas, "
             f"{len(descargadas)} copias locales, {len(no_encontradas)} no encontradas."
         )
+    if isinstance(error_graph, TokenVencido):
+        raise error_graph
+    # Terminó: las facturas con error se reintentan con una búsqueda nueva, no reanudando
+    if diario_busqueda:
+        diario_busqueda.cerrar(eliminar=True)
 
     return {
         "encontradas": encontradas,
         "no_encontradas": no_encontradas,
         "descargadas": descargadas,
     }
+
+def reanudar_busqueda(on_progress=None, ruta=None, **kwargs):
+    """
+    Retoma una búsqueda interrumpida desde su diario (por defecto la más reciente
+    en DIARIOS_DIR). Acepta los mismos argumentos que buscar().
+    """
+    if ruta is None:
+        pendientes = diarios_pendientes(DIARIOS_DIR, DIARIO_MAX_HORAS * 3600)
+        if not pendientes:
+            raise FileNotFoundError("No hay búsquedas pendientes de reanudar.")
+        ruta = pendientes[0]
+    facturas = DiarioBusqueda(ruta).facturas
+    return buscar(facturas, on_progress=on_progress, diario=True, **kwargs)
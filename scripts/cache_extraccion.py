@@ -0,0 +1,234 @@
+from __future__ import annotations
+import os, sys, time, zlib, sqlite3, hashlib, threading
+from contextlib import contextmanager
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# === Caché persistente de resultados de extraer_total ===
+if getattr(sys, "frozen", False):
+    BASE_DIR = Path(sys.executable).parent
+else:
+    BASE_DIR = Path(__file__).resolve().parent
+
+CACHE_PATH = BASE_DIR / "cache_extraccion.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS resultados (
+    huella    TEXT NOT NULL,
+    version   TEXT NOT NULL,
+    total     TEXT,
+    metodo    TEXT,
+    evidencia TEXT,
+    usado     REAL NOT NULL,
+    PRIMARY KEY (huella, version)
+);
+CREATE INDEX IF NOT EXISTS ix_resultados_usado ON resultados (usado);
+CREATE TABLE IF NOT EXISTS archivos (
+    path     TEXT PRIMARY KEY,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    huella   TEXT NOT NULL,
+    usado    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_archivos_usado ON archivos (usado);
+CREATE TABLE IF NOT EXISTS documentos (
+    huella  TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    paginas INTEGER NOT NULL,
+    usado   REAL NOT NULL,
+    PRIMARY KEY (huella, backend)
+);
+CREATE INDEX IF NOT EXISTS ix_documentos_usado ON documentos (usado);
+CREATE TABLE IF NOT EXISTS paginas (
+    huella  TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    pagina  INTEGER NOT NULL,
+    lineas  BLOB NOT NULL,
+    PRIMARY KEY (huella, backend, pagina)
+);
+"""
+
+
+def huella_archivo(path: str | Path, bloque: int = 1024 * 1024) -> str:
+    """SHA-256 del contenido (el mismo PDF copiado o descargado de nuevo da la misma huella)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(bloque):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _comprimir(lineas: List[str]) -> bytes:
+    return zlib.compress("\n".join(lineas).encode("utf-8"), 6)
+
+
+def _descomprimir(blob: bytes) -> List[str]:
+    texto = zlib.decompress(blob).decode("utf-8")
+    return texto.split("\n") if texto else []
+
+
+class CacheExtraccion:
+    """
+    Resultados de extraer_total (total, método, evidencia) por huella del PDF y versión
+    del extractor: un PDF idéntico no se vuelve a procesar y un cambio de reglas
+    (otra versión) invalida todo sin borrar nada a mano.
+
+    Guarda también el texto ya extraído de cada página (comprimido, por huella y
+    backend de lectura): con reglas nuevas se vuelven a evaluar sin reparsear el PDF.
+
+    Para no leer el PDF completo en cada consulta, la huella se recuerda por
+    ruta + tamaño + mtime. Ambas tablas se limitan a `max_entradas`, descartando
+    las menos usadas recientemente.
+    """
+
+    def __init__(self, path: str | Path = CACHE_PATH, max_entradas: int = 20000):
+        self.path = Path(path)
+        self.max_entradas = max(1, max_entradas)
+        self._lock = threading.Lock()
+        self._altas = 0
+        self.aciertos = self.fallos = 0
+        with self._conexion() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(_SCHEMA)
+
+    @contextmanager
+    def _conexion(self):
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            con.execute("PRAGMA synchronous=NORMAL")
+            yield con
+            con.commit()
+        finally:
+            con.close()
+
+    # -------------- Huella --------------
+    def huella(self, path: str | Path) -> str:
+        """Huella del PDF; solo se recalcula si cambió su tamaño o mtime."""
+        ruta = str(Path(path).resolve())
+        st = os.stat(ruta)
+        with self._conexion() as con:
+            row = con.execute("SELECT size, mtime_ns, huella FROM archivos WHERE path = ?", (ruta,)).fetchone()
+            if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+                # Acierto: se marca como usada para que recortar() descarte las menos usadas
+                con.execute("UPDATE archivos SET usado = ? WHERE path = ?", (time.time(), ruta))
+                return row[2]
+
+        huella = huella_archivo(ruta)
+        with self._lock, self._conexion() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO archivos (path, size, mtime_ns, huella, usado) VALUES (?, ?, ?, ?, ?)",
+                (ruta, st.st_size, st.st_mtime_ns, huella, time.time()),
+            )
+        self._contar_alta()
+        return huella
+
+    # -------------- Resultados --------------
+    def obtener(self, huella: str, version: str) -> Optional[dict]:
+        with self._conexion() as con:
+            row = con.execute(
+                "SELECT total, metodo, evidencia FROM resultados WHERE huella = ? AND version = ?",
+                (huella, version),
+            ).fetchone()
+            if row:
+                con.execute("UPDATE resultados SET usado = ? WHERE huella = ? AND version = ?",
+                            (time.time(), huella, version))
+        if not row:
+            self.fallos += 1
+            return None
+        self.aciertos += 1
+        total, metodo, evidencia = row
+        return {"total": Decimal(total) if total is not None else None, "metodo": metodo, "evidencia": evidencia}
+
+    def guardar(self, huella: str, version: str, resultado: dict):
+        total = resultado.get("total")
+        with self._lock, self._conexion() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO resultados (huella, version, total, metodo, evidencia, usado) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (huella, version, str(total) if total is not None else None,
+                 resultado.get("metodo"), resultado.get("evidencia"), time.time()),
+            )
+        self._contar_alta()
+
+    def resultado_anterior(self, huella: str, version: str) -> Optional[dict]:
+        """Resultado más reciente de otra versión del extractor (para comparar reglas)."""
+        with self._conexion() as con:
+            row = con.execute(
+                "SELECT total, metodo, evidencia FROM resultados WHERE huella = ? AND version != ? "
+                "ORDER BY usado DESC LIMIT 1", (huella, version),
+            ).fetchone()
+        if not row:
+            return None
+        total, metodo, evidencia = row
+        return {"total": Decimal(total) if total is not None else None, "metodo": metodo, "evidencia": evidencia}
+
+    # -------------- Texto por página --------------
+    def texto(self, huella: str, backend: str) -> Tuple[Optional[int], Dict[int, List[str]]]:
+        """(número de páginas, {página: líneas}) guardados; (None, {}) si no hay nada."""
+        with self._conexion() as con:
+            row = con.execute("SELECT paginas FROM documentos WHERE huella = ? AND backend = ?",
+                              (huella, backend)).fetchone()
+            if not row:
+                return None, {}
+            con.execute("UPDATE documentos SET usado = ? WHERE huella = ? AND backend = ?",
+                        (time.time(), huella, backend))
+            filas = con.execute("SELECT pagina, lineas FROM paginas WHERE huella = ? AND backend = ?",
+                                (huella, backend)).fetchall()
+        return row[0], {i: _descomprimir(blob) for i, blob in filas}
+
+    def guardar_texto(self, huella: str, backend: str, total_paginas: int, paginas: Dict[int, List[str]]):
+        """Agrega páginas extraídas (las ya guardadas se conservan)."""
+        with self._lock, self._conexion() as con:
+            nuevo = con.execute("SELECT 1 FROM documentos WHERE huella = ? AND backend = ?",
+                                (huella, backend)).fetchone() is None
+            con.execute(
+                "INSERT OR REPLACE INTO documentos (huella, backend, paginas, usado) VALUES (?, ?, ?, ?)",
+                (huella, backend, total_paginas, time.time()),
+            )
+            con.executemany(
+                "INSERT OR REPLACE INTO paginas (huella, backend, pagina, lineas) VALUES (?, ?, ?, ?)",
+                [(huella, backend, i, _comprimir(lineas)) for i, lineas in paginas.items()],
+            )
+        if nuevo:
+            self._contar_alta()
+
+    def documentos(self, backend: str) -> Iterator[Tuple[str, Optional[str]]]:
+        """(huella, última ruta conocida o None) de los documentos con texto guardado."""
+        with self._conexion() as con:
+            filas = con.execute(
+                "SELECT d.huella, (SELECT a.path FROM archivos a WHERE a.huella = d.huella "
+                "ORDER BY a.usado DESC LIMIT 1) FROM documentos d WHERE d.backend = ?",
+                (backend,),
+            ).fetchall()
+        yield from filas
+
+    # -------------- Límite de tamaño --------------
+    def _contar_alta(self):
+        # Revisar el tamaño cada cierto número de altas, no en cada una
+        self._altas += 1
+        if self._altas % 200 == 0:
+            self.recortar()
+
+    def recortar(self):
+        """Deja cada tabla en ~90 % de max_entradas borrando las menos usadas."""
+        objetivo = int(self.max_entradas * 0.9)
+        with self._lock, self._conexion() as con:
+            for tabla in ("resultados", "archivos", "documentos"):
+                n = con.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0]
+                if n > self.max_entradas:
+                    con.execute(
+                        f"DELETE FROM {tabla} WHERE rowid IN "
+                        f"(SELECT rowid FROM {tabla} ORDER BY usado LIMIT ?)",
+                        (n - objetivo,),
+                    )
+                    if tabla == "documentos":
+                        con.execute("DELETE FROM paginas WHERE (huella, backend) NOT IN "
+                                    "(SELECT huella, backend FROM documentos)")
+
+    def limpiar(self):
+        with self._lock, self._conexion() as con:
+            con.execute("DELETE FROM resultados")
+            con.execute("DELETE FROM archivos")
+            con.execute("DELETE FROM documentos")
+            con.execute("DELETE FROM paginas")
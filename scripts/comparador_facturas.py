@@ -7,7 +7,8 @@ import pandas as pd
 
 
 # Usamos el extractor que ya tienes
-from extraer_TotalFactura import extraer_total, DEFAULT_DIR as DEFAULT_PDF_DIR
+from extraer_TotalFactura import DEFAULT_DIR as DEFAULT_PDF_DIR
+from extraccion_lote import extraer_lote, FALLO_TIEMPO, FALLO_MEMORIA
 
 # ---------------- Utils ----------------
 def _norm_amount_to_decimal(s: str | float | int | None) -> Optional[Decimal]:
@@ -70,10 +71,14 @@ def comparar_desde_excel(
     col_factura: str | None = None,
     col_total: str | None = None,
     limite: Optional[int] = None,
+    workers: Optional[int] = None,
 ) -> List[Dict[str, Any]]:
     """
     Lee el Excel, localiza columnas de 'factura' y 'total',
     busca el PDF {factura}.pdf en carpeta_pdfs y compara totales.
+    Los PDFs se extraen en paralelo (workers procesos; por defecto, núcleos), cada uno
+    con límite de tiempo y memoria: el que se excede queda como pdf_tiempo_agotado o
+    pdf_memoria_excedida sin frenar al resto.
     Retorna una lista de dicts con el resultado por factura.
     """
     df = _read_table_any(path_excel)
@@ -104,6 +109,13 @@ def comparar_desde_excel(
     if limite:
         rows = rows[:limite]
 
+    # Extraer primero todos los PDFs existentes (cada uno una sola vez) en el pool
+    pdfs = {pdf_dir / f"{str(f).strip()}.pdf" for f, _ in rows if str(f).strip()}
+    extraidos = {
+        path: (info, error, fallo)
+        for path, info, error, fallo in extraer_lote(sorted(p for p in pdfs if p.exists()), workers=workers, ordenado=False)
+    }
+
     for factura, total_excel_raw in rows:
         factura = str(factura).strip()
         total_excel = _norm_amount_to_decimal(total_excel_raw)
@@ -117,7 +129,7 @@ def comparar_desde_excel(
             continue
 
         pdf_path = pdf_dir / f"{factura}.pdf"
-        if not pdf_path.exists():
+        if pdf_path not in extraidos:
             resultados.append({
                 "factura": factura, "estado": "pdf_no_encontrado",
                 "total_excel": total_excel, "total_pdf": None,
@@ -125,17 +137,19 @@ def comparar_desde_excel(
             })
             continue
 
-        try:
-            info = extraer_total(pdf_path)
-            total_pdf = info.get("total")
-            metodo = info.get("metodo", "?")
-        except Exception as e:
+        info, error, fallo = extraidos[pdf_path]
+        if error is not None:
+            estado = ("pdf_tiempo_agotado" if fallo == FALLO_TIEMPO else
+                      "pdf_memoria_excedida" if fallo == FALLO_MEMORIA else
+                      "error_leyendo_pdf")
             resultados.append({
-                "factura": factura, "estado": "error_leyendo_pdf",
+                "factura": factura, "estado": estado,
                 "total_excel": total_excel, "total_pdf": None,
-                "detalle": str(e)
+                "detalle": error
             })
             continue
+        total_pdf = info.get("total")
+        metodo = info.get("metodo", "?")
 
         if total_excel is None or total_pdf is None:
             resultados.append({
@@ -168,6 +182,7 @@ def imprimir_resumen(resultados: List[Dict[str, Any]]) -> None:
     no_pdf = sum(1 for r in resultados if r["estado"] == "pdf_no_encontrado")
     faltante = sum(1 for r in resultados if r["estado"] in ("dato_faltante", "fila_sin_factura"))
     errores = sum(1 for r in resultados if r["estado"] == "error_leyendo_pdf")
+    excedidos = sum(1 for r in resultados if r["estado"] in ("pdf_tiempo_agotado", "pdf_memoria_excedida"))
 
     print("\n=== RESULTADO COMPARACIÓN ===")
     for r in resultados:
@@ -178,6 +193,7 @@ def imprimir_resumen(resultados: List[Dict[str, Any]]) -> None:
     print(f"  pdf_no_encontrado: {no_pdf}")
     print(f"  dato/otros:    {faltante}")
     print(f"  errores_pdf:   {errores}")
+    print(f"  pdf_limite_excedido: {excedidos}")
     print(f"  TOTAL FILAS:   {len(resultados)}")
 
 # Uso directo por consola 
@@ -189,7 +205,8 @@ if __name__ == "__main__":
     p.add_argument("--col-factura", default=None)
     p.add_argument("--col-total", default=None)
     p.add_argument("--limite", type=int, default=None)
+    p.add_argument("--workers", type=int, default=None, help="Procesos de extracción (por defecto: núcleos)")
     args = p.parse_args()
 
-    res = comparar_desde_excel(args.excel, args.pdfs, args.col_factura, args.col_total, args.limite)
+    res = comparar_desde_excel(args.excel, args.pdfs, args.col_factura, args.col_total, args.limite, args.workers)
     imprimir_resumen(res)
@@ -0,0 +1,95 @@
+from __future__ import annotations
+import time, threading
+from contextlib import contextmanager
+from typing import Optional
+
+# === Control adaptativo de concurrencia (AIMD) para Graph ===
+
+# Señales de throttling de Graph
+_STATUS_THROTTLE = {429, 503}
+
+
+class ControlConcurrencia:
+    """
+    Limita las peticiones en vuelo y ajusta el límite según las respuestas:
+      - aumento aditivo (~+1 por cada `limite` respuestas sanas) mientras la
+        latencia se mantenga por debajo de `tolerancia_latencia` × la mejor vista;
+      - recorte multiplicativo (× `factor`) ante 429/503, 5xx o errores de red,
+        como mucho uno por ventana (≈ una latencia) para no desplomarse con
+        las respuestas de una misma ráfaga.
+    """
+
+    def __init__(self, inicial: int = 4, minimo: int = 1, maximo: int = 32,
+                 factor: float = 0.5, tolerancia_latencia: float = 2.0):
+        self.minimo = max(1, minimo)
+        self.maximo = max(self.minimo, maximo)
+        self.factor = factor
+        self.tolerancia_latencia = tolerancia_latencia
+        self.limite = float(min(max(inicial, self.minimo), self.maximo))
+        self.en_vuelo = 0
+        self.exitos = self.throttles = self.errores = 0
+        self._latencia_ewma: Optional[float] = None
+        self._latencia_base: Optional[float] = None
+        self._ultimo_recorte = 0.0
+        self._cond = threading.Condition()
+
+    # -------------- Turnos --------------
+    @contextmanager
+    def turno(self):
+        """Espera a que haya cupo bajo el límite actual y lo ocupa mientras dura el bloque."""
+        with self._cond:
+            while self.en_vuelo >= int(self.limite):
+                self._cond.wait()
+            self.en_vuelo += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.en_vuelo -= 1
+                self._cond.notify()
+
+    # -------------- Señales --------------
+    def registrar(self, status: Optional[int], latencia: Optional[float] = None):
+        """
+        Informa el resultado de una petición. status=None indica error de red.
+        latencia=None para peticiones cuya duración no es comparable con la de una
+        consulta normal ($batch, descargas): cuentan como éxito sin mover la latencia.
+        """
+        with self._cond:
+            if status is None or status in _STATUS_THROTTLE or status >= 500:
+                if status in _STATUS_THROTTLE:
+                    self.throttles += 1
+                else:
+                    self.errores += 1
+                self._recortar()
+            else:
+                self.exitos += 1
+                if latencia is not None:
+                    self._latencia_ewma = (latencia if self._latencia_ewma is None
+                                           else 0.8 * self._latencia_ewma + 0.2 * latencia)
+                    self._latencia_base = (latencia if self._latencia_base is None
+                                           else min(self._latencia_base, latencia))
+                sana = (self._latencia_ewma is None or
+                        self._latencia_ewma <= self.tolerancia_latencia * self._latencia_base)
+                if sana:
+                    self.limite = min(self.maximo, self.limite + 1.0 / self.limite)
+            self._cond.notify_all()
+
+    def _recortar(self):
+        ahora = time.monotonic()
+        ventana = self._latencia_ewma or 0.1
+        if ahora - self._ultimo_recorte >= ventana:
+            self.limite = max(float(self.minimo), self.limite * self.factor)
+            self._ultimo_recorte = ahora
+
+    # -------------- Estado --------------
+    def estado(self) -> dict:
+        with self._cond:
+            return {
+                "limite": int(self.limite),
+                "en_vuelo": self.en_vuelo,
+                "exitos": self.exitos,
+                "throttles": self.throttles,
+                "errores": self.errores,
+                "latencia_ms": round((self._latencia_ewma or 0.0) * 1000, 1),
+            }
@@ -0,0 +1,104 @@
+from __future__ import annotations
+import os, shutil, hashlib
+from pathlib import Path
+from typing import Tuple
+
+# === Copia incremental de archivos ===
+# Acciones devueltas por copiar_si_cambio() (junto con los bytes escritos)
+SIN_CAMBIOS = "sin_cambios"
+COPIADO = "copiado"
+REFLINK = "reflink"
+HARDLINK = "hardlink"
+
+# FICLONE (Linux, btrfs/xfs): copia con copy-on-write sin duplicar bloques
+_FICLONE = 0x40049409
+
+# Tolerancia de mtime: FAT/exFAT guardan la hora con resolución de 2 s
+_MTIME_TOLERANCIA = 2.0
+
+
+def _sha256(path: Path, bloque: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(bloque):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def es_identico(origen: Path, destino: Path, verificar_hash: bool = False) -> bool:
+    """
+    True si `destino` ya tiene el contenido de `origen`.
+    Compara tamaño y mtime (copy2 conserva el mtime); con verificar_hash compara SHA-256.
+    """
+    try:
+        so, sd = os.stat(origen), os.stat(destino)
+    except OSError:
+        return False
+    if so.st_size != sd.st_size:
+        return False
+    if (so.st_dev, so.st_ino) == (sd.st_dev, sd.st_ino) and so.st_ino:
+        return True  # mismo archivo (hardlink)
+    if verificar_hash:
+        return _sha256(origen) == _sha256(destino)
+    return abs(so.st_mtime - sd.st_mtime) <= _MTIME_TOLERANCIA
+
+
+def _reflink(origen: Path, destino: Path) -> bool:
+    try:
+        import fcntl
+    except ImportError:
+        return False  # Windows
+    try:
+        with open(origen, "rb") as src, open(destino, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        shutil.copystat(origen, destino)
+        return True
+    except OSError:
+        try:
+            os.remove(destino)
+        except OSError:
+            pass
+        return False
+
+
+def _hardlink(origen: Path, destino: Path) -> bool:
+    try:
+        os.link(origen, destino)
+        return True
+    except (OSError, NotImplementedError):
+        return False
+
+
+def copiar_si_cambio(origen: str | Path, destino: str | Path,
+                     enlace: str = "reflink", verificar_hash: bool = False) -> Tuple[str, int]:
+    """
+    Deja en `destino` el contenido de `origen` haciendo el mínimo de E/S:
+      - si ya es idéntico no hace nada (SIN_CAMBIOS);
+      - si no, intenta `enlace` ("reflink", "hardlink" o "no") y si el sistema
+        de archivos no lo permite copia con copy2 (COPIADO).
+    Se escribe en un temporal y se reemplaza, así nunca se escribe a través
+    de un hardlink previo hacia el archivo original.
+    Devuelve (acción, bytes escritos): 0 salvo en COPIADO.
+    """
+    origen, destino = Path(origen), Path(destino)
+    if destino.exists() and es_identico(origen, destino, verificar_hash):
+        return SIN_CAMBIOS, 0
+
+    tmp = destino.with_name(destino.name + ".part")
+    try:
+        os.remove(tmp)
+    except OSError:
+        pass
+
+    accion = None
+    if enlace == REFLINK and _reflink(origen, tmp):
+        accion = REFLINK
+    elif enlace == HARDLINK and _hardlink(origen, tmp):
+        accion = HARDLINK
+    escritos = 0
+    if accion is None:
+        shutil.copy2(origen, tmp)
+        accion, escritos = COPIADO, os.path.getsize(tmp)
+
+    os.replace(tmp, destino)
+    return accion, escritos
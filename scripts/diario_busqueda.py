@@ -0,0 +1,136 @@
+from __future__ import annotations
+import os, json, time, hashlib, threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# === Diario en disco de una búsqueda (reanudable) ===
+# Resultado por factura, igual que en buscar_facturas: (encontrada, destino, mensajes, error)
+Resultado = Tuple[bool, Optional[str], List[str], bool]
+
+
+def id_trabajo(facturas: Iterable[str]) -> str:
+    """Identificador estable de una búsqueda a partir de su lista de facturas."""
+    texto = json.dumps(list(facturas), ensure_ascii=False)
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()[:16]
+
+
+class DiarioBusqueda:
+    """
+    Registro JSONL de una búsqueda: una cabecera con las facturas y una línea por
+    factura resuelta, escrita en cuanto se resuelve. Si la búsqueda se corta (token
+    vencido, equipo suspendido), al abrir el mismo diario se recuperan los resultados
+    ya anotados y solo se vuelve a buscar el resto.
+    Las facturas con error no cuentan como resueltas: se reintentan al reanudar.
+    Con `max_edad` (segundos) tampoco cuentan los resultados anotados hace más tiempo.
+    """
+
+    def __init__(self, path: str | Path, facturas: Optional[Iterable[str]] = None,
+                 max_edad: Optional[float] = None):
+        self.path = Path(path)
+        self.max_edad = max_edad
+        self._lock = threading.Lock()
+        self._f = None
+        self.facturas: List[str] = []
+        self._resultados: Dict[str, Resultado] = {}
+        self._ts: Dict[str, float] = {}
+        self._cargar()
+
+        if facturas is not None and list(facturas) != self.facturas:
+            # Diario nuevo (o de otra lista de facturas): se empieza de cero
+            self.facturas, self._resultados = list(facturas), {}
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"facturas": self.facturas, "inicio": time.time()}, ensure_ascii=False) + "\n")
+
+    # -------------- Lectura --------------
+    def _cargar(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lineas = f.read().splitlines()
+        except OSError:
+            return
+        for n, linea in enumerate(lineas):
+            try:
+                reg = json.loads(linea)
+            except ValueError:
+                continue  # línea a medio escribir cuando se cortó la búsqueda
+            if n == 0:
+                self.facturas = list(reg.get("facturas", []))
+            elif "factura" in reg:
+                # Sin marca de error no se puede saber si quedó resuelta: se vuelve a buscar
+                self._resultados[reg["factura"]] = (
+                    bool(reg.get("encontrada")), reg.get("destino"), list(reg.get("mensajes", [])),
+                    bool(reg.get("error", True)),
+                )
+                self._ts[reg["factura"]] = float(reg.get("ts") or 0)
+
+    def completadas(self) -> Dict[str, Resultado]:
+        """
+        {factura: resultado} de las facturas que no hay que volver a buscar:
+        sin errores, dentro de max_edad y, si se copiaron, con la copia todavía en su sitio.
+        """
+        limite = time.time() - self.max_edad if self.max_edad else None
+        with self._lock:
+            resultados, ts = dict(self._resultados), dict(self._ts)
+        return {
+            fac: res for fac, res in resultados.items()
+            if not res[3] and (limite is None or ts.get(fac, 0) >= limite)
+            and (res[1] is None or os.path.exists(res[1]))
+        }
+
+    # -------------- Escritura --------------
+    def registrar(self, factura: str, resultado: Resultado):
+        """Anota el resultado de una factura (seguro entre hilos)."""
+        encontrada, destino, mensajes, error = resultado
+        destino = str(destino) if destino is not None else None
+        ts = time.time()
+        linea = json.dumps({
+            "factura": factura, "encontrada": bool(encontrada), "destino": destino,
+            "mensajes": list(mensajes), "error": bool(error), "ts": ts,
+        }, ensure_ascii=False)
+        with self._lock:
+            self._resultados[factura] = (bool(encontrada), destino, list(mensajes), bool(error))
+            self._ts[factura] = ts
+            if self._f is None:
+                self._f = open(self.path, "a+", encoding="utf-8")
+                # Si la última línea quedó cortada, la siguiente empieza en una línea nueva
+                if self._f.tell():
+                    self._f.seek(self._f.tell() - 1)
+                    if self._f.read(1) != "\n":
+                        self._f.write("\n")
+            self._f.write(linea + "\n")
+            self._f.flush()
+
+    def cerrar(self, eliminar: bool = False):
+        """Cierra el archivo; con eliminar=True lo borra (búsqueda terminada)."""
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+        if eliminar:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def diarios_pendientes(carpeta: str | Path, max_edad: Optional[float] = None) -> List[Path]:
+    """
+    Diarios de búsquedas sin terminar, del más reciente al más antiguo.
+    Con `max_edad` (segundos) se borran los que no se tocan desde hace más tiempo.
+    """
+    carpeta = Path(carpeta)
+    if not carpeta.is_dir():
+        return []
+    limite = time.time() - max_edad if max_edad else None
+    pendientes = []
+    for p in carpeta.glob("*.jsonl"):
+        try:
+            mtime = p.stat().st_mtime
+            if limite is not None and mtime < limite:
+                os.remove(p)
+                continue
+        except OSError:
+            continue
+        pendientes.append((mtime, p))
+    return [p for _, p in sorted(pendientes, reverse=True)]
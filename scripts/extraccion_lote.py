@@ -0,0 +1,282 @@
+from __future__ import annotations
+import os, sys, time, threading, multiprocessing
+from multiprocessing.connection import wait
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from extraer_TotalFactura import extraer_total, total_en_cache
+
+# === Extracción de totales de muchos PDFs en procesos aislados ===
+# extraer_total es CPU puro (pdfplumber/pdfminer): con hilos no pasa de un núcleo por el GIL.
+EXTRACCION_WORKERS = int(os.getenv("EXTRACCION_WORKERS") or 0)  # 0 = núcleos del equipo
+EXTRACCION_CHUNK = int(os.getenv("EXTRACCION_CHUNK") or 8)  # PDFs por bloque enviado a un proceso
+# Bloques que atiende cada proceso antes de reemplazarlo (pdfminer no devuelve toda la memoria)
+EXTRACCION_TAREAS_POR_WORKER = int(os.getenv("EXTRACCION_TAREAS_POR_WORKER") or 25)
+# Presupuesto por PDF: segundos de reloj y memoria (RSS) del proceso; 0 = sin límite.
+# El PDF que lo excede se entrega con su fallo y su proceso se reemplaza.
+EXTRACCION_TIEMPO_MAX = float(os.getenv("EXTRACCION_TIEMPO_MAX") or 60)
+EXTRACCION_MEMORIA_MAX_MB = int(os.getenv("EXTRACCION_MEMORIA_MAX_MB") or 1024)
+
+# Tipos de fallo de un PDF
+FALLO_ERROR = "error"                # extraer_total lanzó una excepción
+FALLO_TIEMPO = "tiempo_agotado"      # superó EXTRACCION_TIEMPO_MAX
+FALLO_MEMORIA = "memoria_excedida"   # su proceso superó EXTRACCION_MEMORIA_MAX_MB
+FALLO_PROCESO = "proceso_caido"      # su proceso murió por otra causa
+
+# (path, resultado de extraer_total o None, mensaje de error o None, tipo de fallo o None)
+ResultadoLote = Tuple[Path, Optional[dict], Optional[str], Optional[str]]
+
+_SALIDA_MEMORIA = 86  # código de salida del proceso que se pasó de memoria
+
+
+# ====== Memoria del proceso ======
+def _rss_mb() -> Optional[float]:
+    """Memoria residente del proceso actual en MB (None si no se puede medir)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        pass
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class _Contadores(ctypes.Structure):  # PROCESS_MEMORY_COUNTERS
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (n, ctypes.c_size_t) for n in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                    "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage",
+                )
+            ]
+
+        kernel32, psapi = ctypes.WinDLL("kernel32"), ctypes.WinDLL("psapi")
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(_Contadores), wintypes.DWORD]
+        c = _Contadores()
+        c.cb = ctypes.sizeof(c)
+        if psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(c), c.cb):
+            return c.WorkingSetSize / 2**20
+        return None
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _vigilar_memoria(limite_mb: int, intervalo: float = 0.2):
+    """Hilo del proceso hijo: si el RSS pasa el límite, termina el proceso en el acto."""
+    while True:
+        rss = _rss_mb()
+        if rss is None:
+            return  # sin forma de medir en esta plataforma
+        if rss > limite_mb:
+            os._exit(_SALIDA_MEMORIA)
+        time.sleep(intervalo)
+
+
+# ====== Proceso hijo ======
+def _trabajador(conn, memoria_max_mb: int, bloques_max: int):
+    """
+    Bucle del proceso hijo. Recibe bloques [(índice, path)] y avisa al padre cuándo
+    empieza cada PDF y con qué termina, para que pueda cortar justo el que se excede.
+    """
+    if memoria_max_mb > 0:
+        threading.Thread(target=_vigilar_memoria, args=(memoria_max_mb,), daemon=True).start()
+    atendidos = 0
+    while (bloque := conn.recv()) is not None:
+        for i, path in bloque:
+            conn.send(("inicio", i))
+            try:
+                conn.send(("fin", i, extraer_total(Path(path)), None))
+            except Exception as e:
+                conn.send(("fin", i, None, str(e)))
+        atendidos += 1
+        seguir = not bloques_max or atendidos < bloques_max
+        conn.send(("bloque", seguir))
+        if not seguir:
+            break
+    conn.close()
+
+
+class _Proceso:
+    """Lado del padre de un proceso hijo: bloque asignado y PDF en curso."""
+
+    def __init__(self, ctx, memoria_max_mb: int, bloques_max: int):
+        self.conn, hijo = ctx.Pipe()
+        self.proc = ctx.Process(target=_trabajador, args=(hijo, memoria_max_mb, bloques_max), daemon=True)
+        self.proc.start()
+        hijo.close()
+        self.bloque: List[Tuple[int, str]] = []  # PDFs del bloque aún sin resultado
+        self.actual: Optional[Tuple[int, str]] = None
+        self.desde = 0.0
+        self.retirado = False  # terminó su cupo de bloques y va a salir
+        self.ocupado = False  # tiene un bloque asignado cuyo cierre ("bloque") no llegó
+
+    def asignar(self, bloque: List[Tuple[int, str]]):
+        self.bloque = list(bloque)
+        self.ocupado = True
+        self.conn.send(bloque)
+
+    def detener(self, matar: bool = False):
+        try:
+            if matar:
+                self.proc.kill()
+            elif self.proc.is_alive() and not self.retirado:
+                self.conn.send(None)
+        except OSError:
+            pass
+        self.proc.join(timeout=5)
+        if self.proc.is_alive():
+            self.proc.kill()
+            self.proc.join(timeout=5)
+        self.conn.close()
+
+
+# ====== API ======
+def extraer_lote(
+    paths: Iterable[str | Path],
+    workers: Optional[int] = None,
+    chunk: Optional[int] = None,
+    ordenado: bool = True,
+    tareas_por_worker: Optional[int] = None,
+    tiempo_max: Optional[float] = None,
+    memoria_max_mb: Optional[int] = None,
+) -> Iterator[ResultadoLote]:
+    """
+    Extrae el total de cada PDF repartiendo el trabajo en `workers` procesos.
+
+    - Los PDFs se envían en bloques de `chunk`, un bloque por proceso a la vez, así
+      una lista enorme no se encola entera.
+    - ordenado=True entrega en el orden de `paths`; con False, a medida que terminan.
+    - Los que ya están en la caché de extracción se entregan sin pasar por los procesos.
+    - Cada PDF tiene `tiempo_max` segundos y su proceso `memoria_max_mb` de RSS. El que
+      se excede (o mata su proceso) se entrega con FALLO_TIEMPO / FALLO_MEMORIA /
+      FALLO_PROCESO, el proceso se reemplaza y el resto de su bloque sigue en otro.
+    """
+    paths = [Path(p) for p in paths]
+    workers = workers or EXTRACCION_WORKERS or os.cpu_count() or 1
+    chunk = max(1, chunk or EXTRACCION_CHUNK)
+    tareas_por_worker = EXTRACCION_TAREAS_POR_WORKER if tareas_por_worker is None else tareas_por_worker
+    tiempo_max = EXTRACCION_TIEMPO_MAX if tiempo_max is None else tiempo_max
+    memoria_max_mb = EXTRACCION_MEMORIA_MAX_MB if memoria_max_mb is None else memoria_max_mb
+
+    listos: Dict[int, ResultadoLote] = {}
+    siguiente = 0  # próximo índice a entregar en modo ordenado
+
+    def entregar(i: int, resultado: Optional[dict], error: Optional[str], fallo: Optional[str] = None):
+        if error is not None and fallo is None:
+            fallo = FALLO_ERROR
+        listos[i] = (paths[i], resultado, error, fallo)
+
+    def vaciar() -> Iterator[ResultadoLote]:
+        nonlocal siguiente
+        if not ordenado:
+            while listos:
+                yield listos.pop(next(iter(listos)))
+            return
+        while siguiente in listos:
+            yield listos.pop(siguiente)
+            siguiente += 1
+
+    pendientes: List[Tuple[int, str]] = []
+    for i, p in enumerate(paths):
+        if (guardado := total_en_cache(p)) is not None:
+            entregar(i, guardado, None)
+        else:
+            pendientes.append((i, str(p)))
+    yield from vaciar()
+    if not pendientes:
+        return
+
+    if not tiempo_max and not memoria_max_mb and (workers <= 1 or len(pendientes) <= chunk):
+        # Sin presupuesto que vigilar y pocos PDFs: arrancar procesos cuesta más que extraerlos aquí
+        for i, path in pendientes:
+            try:
+                entregar(i, extraer_total(Path(path)), None)
+            except Exception as e:
+                entregar(i, None, str(e))
+            yield from vaciar()
+        return
+
+    cola = [pendientes[k:k + chunk] for k in range(0, len(pendientes), chunk)]
+    cola.reverse()  # se sacan con pop() desde el final
+    ctx = multiprocessing.get_context("spawn")  # procesos limpios, igual en Windows y Linux
+    nuevo = lambda: _Proceso(ctx, memoria_max_mb, tareas_por_worker)
+    procesos = [nuevo() for _ in range(min(workers, len(cola)))]
+
+    def descartar(p: _Proceso, fallo: str, mensaje: str) -> _Proceso:
+        """Da por perdido el PDF en curso de `p`, devuelve el resto de su bloque a la cola."""
+        culpable = p.actual or p.bloque[0]
+        entregar(culpable[0], None, mensaje.format(nombre=Path(culpable[1]).name), fallo)
+        if resto := [item for item in p.bloque if item != culpable]:
+            cola.append(resto)
+        p.bloque, p.actual, p.ocupado = [], None, False
+        p.detener(matar=True)
+        return nuevo()
+
+    try:
+        while cola or any(p.ocupado for p in procesos):
+            for k, p in enumerate(procesos):
+                if p.retirado and not p.ocupado and cola:
+                    p.detener()
+                    procesos[k] = p = nuevo()
+                if not p.ocupado and not p.retirado and cola:
+                    bloque = cola.pop()
+                    try:
+                        p.asignar(bloque)
+                    except OSError:
+                        # El proceso murió estando libre: el bloque vuelve a la cola
+                        cola.append(bloque)
+                        p.bloque, p.ocupado = [], False
+                        p.detener(matar=True)
+                        procesos[k] = nuevo()
+
+            ocupados = [p for p in procesos if p.ocupado]
+            espera = None
+            if tiempo_max:
+                en_curso = [p.desde + tiempo_max for p in ocupados if p.actual is not None]
+                espera = max(0.0, min(en_curso) - time.monotonic()) if en_curso else tiempo_max
+            wait([p.conn for p in ocupados] + [p.proc.sentinel for p in ocupados], espera)
+
+            ahora = time.monotonic()
+            for k, p in enumerate(procesos):
+                if not p.ocupado:
+                    continue
+                muerto = not p.proc.is_alive()  # antes de leer: lo que envió antes de morir ya está en el pipe
+                try:
+                    while p.conn.poll():
+                        msg = p.conn.recv()
+                        if msg[0] == "inicio":
+                            p.actual = next(item for item in p.bloque if item[0] == msg[1])
+                            p.desde = time.monotonic()
+                        elif msg[0] == "fin":
+                            _, i, resultado, error = msg
+                            entregar(i, resultado, error)
+                            p.bloque = [item for item in p.bloque if item[0] != i]
+                            p.actual = None
+                        elif msg[0] == "bloque":
+                            p.ocupado, p.retirado = False, not msg[1]
+                except (EOFError, OSError):
+                    pass  # el proceso murió; se trata abajo
+
+                if p.ocupado and muerto:
+                    p.proc.join()
+                    if not p.bloque:
+                        # Murió con todo el bloque ya entregado: solo se reemplaza
+                        p.ocupado = False
+                        p.detener(matar=True)
+                        procesos[k] = nuevo()
+                    elif p.proc.exitcode == _SALIDA_MEMORIA:
+                        procesos[k] = descartar(p, FALLO_MEMORIA,
+                                                f"{{nombre}} superó el límite de memoria ({memoria_max_mb} MB)")
+                    else:
+                        procesos[k] = descartar(p, FALLO_PROCESO,
+                                                f"El proceso de extracción terminó inesperadamente con {{nombre}} "
+                                                f"(código {p.proc.exitcode})")
+                elif p.ocupado and tiempo_max and p.actual is not None and ahora - p.desde > tiempo_max:
+                    procesos[k] = descartar(p, FALLO_TIEMPO, f"{{nombre}} superó el tiempo máximo ({tiempo_max:g} s)")
+            yield from vaciar()
+    finally:
+        for p in procesos:
+            p.detener(matar=p.ocupado)
@@ -1,15 +1,11 @@
 from __future__ import annotations
-import re,  unicodedata, sys
+import re,  unicodedata, sys, os, time, hashlib, itertools, threading
+from collections import deque
 from pathlib import Path
 from decimal import Decimal
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 
-try:
-    import pdfplumber
-    PDFPLUMBER_OK = True
-except Exception:
-    from pdfminer.high_level import extract_text as pdfminer_extract_text
-    PDFPLUMBER_OK = False
+from motores_pdf import MotorTexto, disponibles, elegir_motor, guardar_calibracion, recorte_calibrado
 
 # === RUTAS CONSISTENTES CON buscar_facturas.py ===
 if getattr(sys, "frozen", False):
@@ -23,8 +19,29 @@ DEFAULT_DIR = BASE_DIR / "Facturas_descargadas"
 
 
 # ====== Utilidades ======
+def _tabla_sin_acentos() -> dict:
+    """
+    Tabla para str.translate equivalente a quitar las marcas de NFD (Á→A, Ñ→N, Ü→U…),
+    calculada una vez para los bloques latinos y las marcas combinantes sueltas.
+    """
+    tabla = {}
+    for cp in itertools.chain(range(0xC0, 0x250), range(0x1E00, 0x1F00)):
+        c = chr(cp)
+        base = ''.join(x for x in unicodedata.normalize('NFD', c) if unicodedata.category(x) != 'Mn')
+        if base != c:
+            tabla[cp] = base
+    for cp in range(0x300, 0x370):
+        tabla[cp] = None
+    return tabla
+
+_SIN_ACENTOS = _tabla_sin_acentos()
+_SIN_ACENTOS_NI_GUION = {**_SIN_ACENTOS, 0xAD: "-"}  # ARREGLA GUION INVISIBLE
+
 def _strip_accents(s: str) -> str:
-    return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
+    return s.translate(_SIN_ACENTOS)
+
+_RE_INICIO_NO_NUM = re.compile(r'^[^0-9.,+-]*')
+_RE_FIN_NO_NUM = re.compile(r'[^0-9.,+-].*$')
 
 def _norm_amount(s: str) -> Optional[Decimal]:
     if not s:
@@ -32,8 +49,8 @@ def _norm_amount(s: str) -> Optional[Decimal]:
         
     s = s.strip()
     s = s.replace(" ", "").replace(chr(160), "").replace(chr(8203), "")
-    s = re.sub(r'^[^0-9.,+-]*', '', s)
-    s = re.sub(r'[^0-9.,+-].*$', '', s)
+    s = _RE_INICIO_NO_NUM.sub('', s)
+    s = _RE_FIN_NO_NUM.sub('', s)
     
     if not s:
         return None
@@ -50,20 +67,23 @@ def _norm_amount(s: str) -> Optional[Decimal]:
         return None
 
 # ====== Números en letras ======
+_VALORES_LETRAS = {
+    'CERO':0,'UN':1,'UNO':1,'DOS':2,'TRES':3,'CUATRO':4,'CINCO':5,'SEIS':6,'SIETE':7,'OCHO':8,'NUEVE':9,
+    'DIEZ':10,'ONCE':11,'DOCE':12,'TRECE':13,'CATORCE':14,'QUINCE':15,'DIECISEIS':16,
+    'DIECISIETE':17,'DIECIOCHO':18,'DIECINUEVE':19,'VEINTE':20,'VEINTI':20,'VEINTIUN':21,'VEINTIUNO':21,
+    'VEINTIDOS':22,'VEINTITRES':23,'VEINTICUATRO':24,'VEINTICINCO':25,'VEINTISEIS':26,'VEINTISIETE':27,
+    'VEINTIOCHO':28,'VEINTINUEVE':29,'TREINTA':30,'CUARENTA':40,'CINCUENTA':50,'SESENTA':60,
+    'SETENTA':70,'OCHENTA':80,'NOVENTA':90,'CIEN':100,'CIENTO':100,'DOSCIENTOS':200,'TRESCIENTOS':300,
+    'CUATROCIENTOS':400,'QUINIENTOS':500,'SEISCIENTOS':600,'SETECIENTOS':700,'OCHOCIENTOS':800,
+    'NOVECIENTOS':900,'MIL':1000,'MILLON':1000000,'MILLONES':1000000
+}
+_RE_NO_LETRAS = re.compile(r"[^A-ZÑ0-9\s/]")
+_RE_CENTAVOS = re.compile(r"(\d\d?)/100")
+
 def letras_a_numero(frase: str) -> Decimal:
     frase = _strip_accents(frase.upper())
-    frase = re.sub(r"[^A-ZÑ0-9\s/]", " ", frase)
-    
-    valores = {
-        'CERO':0,'UN':1,'UNO':1,'DOS':2,'TRES':3,'CUATRO':4,'CINCO':5,'SEIS':6,'SIETE':7,'OCHO':8,'NUEVE':9,
-        'DIEZ':10,'ONCE':11,'DOCE':12,'TRECE':13,'CATORCE':14,'QUINCE':15,'DIECISEIS':16,
-        'DIECISIETE':17,'DIECIOCHO':18,'DIECINUEVE':19,'VEINTE':20,'VEINTI':20,'VEINTIUN':21,'VEINTIUNO':21,
-        'VEINTIDOS':22,'VEINTITRES':23,'VEINTICUATRO':24,'VEINTICINCO':25,'VEINTISEIS':26,'VEINTISIETE':27,
-        'VEINTIOCHO':28,'VEINTINUEVE':29,'TREINTA':30,'CUARENTA':40,'CINCUENTA':50,'SESENTA':60,
-        'SETENTA':70,'OCHENTA':80,'NOVENTA':90,'CIEN':100,'CIENTO':100,'DOSCIENTOS':200,'TRESCIENTOS':300,
-        'CUATROCIENTOS':400,'QUINIENTOS':500,'SEISCIENTOS':600,'SETECIENTOS':700,'OCHOCIENTOS':800,
-        'NOVECIENTOS':900,'MIL':1000,'MILLON':1000000,'MILLONES':1000000
-    }
+    frase = _RE_NO_LETRAS.sub(" ", frase)
+    valores = _VALORES_LETRAS
     
     total = grupo = 0
     palabras = frase.split()
@@ -83,112 +103,558 @@ def letras_a_numero(frase: str) -> Decimal:
                 i += 1
         i += 1
     total += grupo
-    if m := re.search(r"(\d\d?)/100", frase):
+    if m := _RE_CENTAVOS.search(frase):
         total += Decimal(m.group(1)) / 100
     return Decimal(total)
 
 # ====== Leer líneas ======
+# Motor de texto (PDF_MOTOR o el calibrado); el texto guardado en caché solo se
+# reutiliza con el mismo motor y versión
+MOTOR = elegir_motor()
+BACKEND = MOTOR.clave
+# Extracción por franja: primero solo la parte inferior de la última página (donde
+# suelen estar total, "SON:" y "VALOR A PAGAR"), desde EXTRAER_FRANJA de la altura.
+# Por defecto, lo que haya validado la calibración.
+_recorte_env = os.getenv("EXTRAER_RECORTE")
+EXTRAER_RECORTE = (_recorte_env.strip().lower() in ("1", "true", "si", "sí")) if _recorte_env else recorte_calibrado()
+EXTRAER_FRANJA = float(os.getenv("EXTRAER_FRANJA") or 0.5)
+
+class TextoNoGuardado(LookupError):
+    """Falta el texto de una página y no hay PDF del que extraerlo."""
+
+def _lineas_de(texto: str) -> List[str]:
+    return [l.strip() for l in texto.splitlines() if l.strip()]
+
+class PaginasPDF:
+    """
+    Texto de un PDF página por página, extraído bajo demanda.
+    Cada página se extrae una sola vez aunque se consulte varias veces
+    (p. ej. primero la última y después el documento completo).
+
+    Con `almacen` y `huella`, las páginas ya guardadas salen de la caché de textos
+    sin abrir el PDF, y las que se extraigan se guardan al cerrar. `path` puede ser
+    None si todo el texto necesario está guardado.
+    """
+
+    def __init__(self, path: Optional[Path], huella: Optional[str] = None, almacen=None,
+                 motor: Optional[MotorTexto] = None):
+        self.path = Path(path) if path is not None else None
+        self.motor = motor or MOTOR
+        self._doc = None
+        self._lineas: Dict[int, List[str]] = {}
+        self._nuevas: List[int] = []
+        self._almacen = almacen if huella else None
+        self._huella = huella
+        self.total = None
+        if self._almacen is not None:
+            try:
+                self.total, self._lineas = self._almacen.texto(huella, self.motor.clave)
+            except Exception:
+                self.total, self._lineas = None, {}  # sin texto guardado: se lee el PDF
+        if self.total is None:
+            self._abrir()
+
+    def _abrir(self):
+        if self.path is None:
+            raise TextoNoGuardado(f"Sin PDF ni texto guardado para {self._huella}")
+        self._doc = self.motor.abrir(self.path)
+        self.total = len(self._doc)
+
+    def __len__(self):
+        return self.total
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def cerrar(self):
+        if self._doc is not None:
+            self._doc.cerrar()
+            self._doc = None
+        if self._nuevas and self._almacen is not None:
+            try:
+                self._almacen.guardar_texto(self._huella, self.motor.clave, self.total,
+                                            {i: self._lineas[i] for i in self._nuevas})
+            except Exception:
+                pass  # la caché de textos es opcional
+            self._nuevas = []
+
+    def pagina(self, i: int) -> List[str]:
+        """Líneas no vacías de la página i (0 = primera)."""
+        if i not in self._lineas:
+            if self._doc is None:
+                self._abrir()
+            self._lineas[i] = _lineas_de(self._doc.texto(i))
+            self._nuevas.append(i)
+        return self._lineas[i]
+
+    def franja_final(self, desde: float) -> Optional[List[str]]:
+        """
+        Líneas de la franja inferior de la última página (desde = fracción de la altura).
+        None si el motor no sabe recortar o la página completa ya está disponible.
+        La franja no se guarda en la caché de textos.
+        """
+        i = self.total - 1
+        if i < 0 or i in self._lineas:
+            return None
+        if self._doc is None:
+            self._abrir()
+        texto = self._doc.texto_region(i, desde)
+        return _lineas_de(texto) if texto is not None else None
+
+    def desde_el_final(self) -> Iterator[Tuple[int, List[str]]]:
+        """(índice, líneas) de la última página a la primera."""
+        for i in reversed(range(self.total)):
+            yield i, self.pagina(i)
+
+    def lineas(self) -> List[str]:
+        """Todas las líneas del documento en orden."""
+        return [l for i in range(self.total) for l in self.pagina(i)]
+
 def read_lines(path: Path) -> List[str]:
-    if PDFPLUMBER_OK:
-        with pdfplumber.open(path) as pdf:
-            texto = ""
-            for page in pdf.pages:
-                texto += page.extract_text() or ""
-    else:
-        texto = pdfminer_extract_text(str(path))
-    lineas = [l.strip() for l in texto.splitlines() if l.strip()]
-    return lineas
+    with PaginasPDF(path) as paginas:
+        return paginas.lineas()
 
 # ====== EXTRAER TOTAL ======
-def extraer_total(path: Path) -> dict:
-    lineas = read_lines(path)
-    texto_full = "\n".join(lineas)
-    texto_up = texto_full.upper()
-    texto_strip = _strip_accents(texto_up.replace("­", "-").replace(chr(173), "-"))  # ARREGLA GUION INVISIBLE
-    
-    # 1. LETRAS → PRIORIDAD MÁXIMA (AHORA INCLUYE CASOS SIN "SON" NI "PESOS")
-    patrones_letras = [        
-        r"\(\s*([A-ZÑ0-9\s/]+?)\s*\)",  
-        r"VALOR EN LETRAS.*?([A-ZÑ0-9\s/]{20,})", 
-        r"SON[:\.\s]*([A-ZÑ0-9\s/]{15,})",
-        r"([A-ZÑ0-9\s/]{20,})PESOS",
-        r"([A-ZÑ0-9\s/]{20,})PESO COLOMBIANO",    
-        r"([A-ZÑ0-9\s/]{20,})\s*$"                 
-    ]
-    for pat in patrones_letras:
-        if m := re.search(pat, texto_strip, re.DOTALL):
+CACHE_EXTRACCION = os.getenv("CACHE_EXTRACCION", "1").lower() in ("1", "true", "si", "sí")
+CACHE_EXTRACCION_MAX = int(os.getenv("CACHE_EXTRACCION_MAX", "20000"))
+# Guardar también el texto por página (permite reevaluar reglas sin reparsear PDFs)
+CACHE_TEXTOS = os.getenv("CACHE_TEXTOS", "1").lower() in ("1", "true", "si", "sí")
+_cache = None
+_cache_lock = threading.Lock()
+
+def _get_cache():
+    """Caché persistente compartida (se abre al primer uso; None si está desactivada o falla)."""
+    global _cache, CACHE_EXTRACCION
+    if not CACHE_EXTRACCION:
+        return None
+    with _cache_lock:
+        if _cache is None:
             try:
-                frase = re.sub(r"\s+PESOS?.*", "", m.group(1))  # quita "PESOS" al final
-                total = letras_a_numero(frase)
-                if total >= 1000:
-                    return {"total": total, "metodo": "LETRAS (100% SEGURO)", "evidencia": f"LETRAS: {frase.strip()[:80]}"}
-            except: pass
+                from cache_extraccion import CacheExtraccion
+                _cache = CacheExtraccion(BASE_DIR / "cache_extraccion.sqlite", max_entradas=CACHE_EXTRACCION_MAX)
+            except Exception:
+                CACHE_EXTRACCION = False  # sin caché, pero la extracción sigue
+                return None
+        return _cache
 
-    # 2. TOTAL: EN MISMA LÍNEA (CON O SIN $)
-    for linea in lineas:
-        if re.search(r"\bTOTAL\s*[:.]", linea.upper()):
-            numeros = re.findall(r"[\d\.,]+", linea)
-            for num in numeros:
-                if len(num.replace(".", "").replace(",", "")) >= 4:  
-                    if amt := _norm_amount(num):
-                        if amt >= 1000:
-                            return {
-                                "total": amt,
-                                "metodo": "TOTAL: EN MISMA LÍNEA",
-                                "evidencia": linea.strip()[:120]
-                            }
-
-    # 3. VALOR TOTAL DE LA OPERACIÓN (ya estaba)
-    keywords_operacion = ["VALOR TOTAL DE LA OPERACIÓN", "TOTAL OPERACIÓN", "VALOR A PAGAR", "TOTAL NETO"]
-    if any(k in texto_up for k in keywords_operacion):
-        for i, linea in enumerate(lineas):
-            if any(k in linea.upper() for k in keywords_operacion):
-                for j in range(i, min(i+15, len(lineas))):
-                    candidato = lineas[j]
-                    if "$" in candidato:
-                        if nums := re.findall(r"\$\s*[\d.,]+", candidato):
-                            if amt := _norm_amount(nums[-1]):
-                                if amt >= 1000:
-                                    return {"total": amt, "metodo": "VALOR TOTAL OPERACIÓN", "evidencia": f"{linea[:50]} → {candidato[:50]}"}
+def _buscar_en_cache(path: Path) -> Tuple[Optional[str], Optional[dict]]:
+    """(huella, resultado guardado o None); huella None si no hay caché utilizable."""
+    if (cache := _get_cache()) is None:
+        return None, None
+    try:
+        huella = cache.huella(path)
+        return huella, cache.obtener(huella, VERSION_EXTRACTOR)
+    except Exception:
+        return None, None  # un problema de la caché no impide extraer
+
+def total_en_cache(path: Path) -> Optional[dict]:
+    """Resultado ya guardado para este PDF, sin abrirlo; None si no está en caché."""
+    return _buscar_en_cache(path)[1]
+
+def extraer_total(path: Path, usar_cache: bool = True) -> dict:
+    """
+    Total de la factura {total, metodo, evidencia}. Con caché, un PDF ya procesado
+    (mismo contenido y misma versión de reglas) no se vuelve a leer.
+    """
+    huella = None
+    if usar_cache:
+        huella, guardado = _buscar_en_cache(path)
+        if guardado is not None:
+            return guardado
+
+    resultado = _extraer_total_pdf(path, huella)
+    if huella is not None:
+        try:
+            _cache.guardar(huella, VERSION_EXTRACTOR, resultado)
+        except Exception:
+            pass
+    return resultado
+
+def _extraer_total_pdf(path: Optional[Path], huella: Optional[str] = None,
+                       motor: Optional[MotorTexto] = None, recorte: Optional[bool] = None) -> dict:
+    almacen = _cache if CACHE_TEXTOS and huella else None
+    recorte = EXTRAER_RECORTE if recorte is None else recorte
+    with PaginasPDF(path, huella, almacen, motor) as paginas:
+        # Solo la franja de los totales: si el valor en letras está ahí, no se procesa
+        # el resto de la página (en facturas con mucho detalle es lo más caro)
+        if recorte and (franja := paginas.franja_final(EXTRAER_FRANJA)):
+            if resultado := _extraer_de_lineas(franja, final=False):
+                return resultado
+        # El total casi siempre está en la última página: si el valor en letras está
+        # ahí con su rótulo (ReglaLetras.anclados), no se extrae el resto (anexos,
+        # detalle de ítems…). Lo demás necesita el documento completo: "TOTAL:" o un
+        # "(MIL UNIDADES)" de un anexo no pueden ganarle a un "SON:" de una página anterior.
+        if len(paginas) > 1:
+            _, ultima = next(paginas.desde_el_final())
+            if resultado := _extraer_de_lineas(ultima, final=False):
+                return resultado
+        return _extraer_de_lineas(paginas.lineas())
+
+# ====== Reglas de extracción ======
+# Cada estrategia es una regla compilada al importar. Las reglas de línea se evalúan
+# juntas en una sola pasada; gana la de mayor prioridad (orden de REGLAS_LINEA).
+_RE_NUMEROS = re.compile(r"[\d\.,]+")
+_RE_MONTO_PESOS = re.compile(r"\$\s*[\d.,]+")
+_RE_QUITA_PESOS = re.compile(r"\s+PESOS?.*")
+_lock_disparos = threading.Lock()
+
+def _ultimo_monto_pesos(linea: str) -> Optional[Decimal]:
+    """Último '$ número' de la línea si es un total plausible (>= 1000)."""
+    if "$" in linea:
+        if nums := _RE_MONTO_PESOS.findall(linea):
+            if (amt := _norm_amount(nums[-1])) and amt >= 1000:
+                return amt
+    return None
+
+class Regla:
+    """Estrategia de extracción del total. `disparos` cuenta las veces que dio el resultado."""
+    def __init__(self, metodo: str):
+        self.metodo = metodo
+        self.disparos = 0
+
+    def firma(self) -> str:
+        """Tipo y parámetros de la regla (sin contadores), para VERSION_EXTRACTOR."""
+        params = sorted((k, repr(v)) for k, v in vars(self).items() if k != "disparos")
+        return f"{type(self).__name__}{params}"
+
+    def nuevo_estado(self):
+        return None
+
+    def linea(self, estado, i: int, linea: str, linea_up: str, lineas: List[str]) -> Optional[dict]:
+        return None
+
+    def cierre(self, estado) -> Optional[dict]:
+        return None
+
+class ReglaLetras(Regla):
+    """
+    Valor en letras buscado en todo el texto (sin acentos); patrones en orden.
+    Cada patrón solo mira su primera coincidencia, así que sobre un trozo del documento
+    (parcial=True) solo se aceptan los patrones de `anclados`: los que van pegados a un
+    rótulo del total ("SON:", "VALOR EN LETRAS", "… PESOS"). Un paréntesis cualquiera o
+    la cola de una línea pueden ser otra cosa que en el documento completo no ganaría.
+    """
 
+    def __init__(self, metodo: str, patrones: List[str], anclados: Tuple[int, ...] = ()):
+        super().__init__(metodo)
+        self.patrones = [re.compile(p, re.DOTALL) for p in patrones]
+        self.anclados = tuple(anclados)
+
+    def documento(self, texto_strip: str, parcial: bool = False) -> Optional[dict]:
+        for k, pat in enumerate(self.patrones):
+            if m := pat.search(texto_strip):
+                try:
+                    frase = _RE_QUITA_PESOS.sub("", m.group(1))  # quita "PESOS" al final
+                    total = letras_a_numero(frase)
+                    if total >= 1000:
+                        if parcial and k not in self.anclados:
+                            return None  # el documento completo decide
+                        return {"total": total, "metodo": self.metodo, "evidencia": f"LETRAS: {frase.strip()[:80]}"}
+                except Exception:
+                    pass
+        return None
+
+class ReglaMismaLinea(Regla):
+    """Primera línea con `patron` que trae un número de al menos `min_digitos` cifras."""
+
+    def __init__(self, metodo: str, patron: str, min_digitos: int = 4):
+        super().__init__(metodo)
+        self.patron = re.compile(patron)
+        self.min_digitos = min_digitos
+
+    def linea(self, estado, i, linea, linea_up, lineas):
+        if self.patron.search(linea_up):
+            for num in _RE_NUMEROS.findall(linea):
+                if len(num.replace(".", "").replace(",", "")) >= self.min_digitos:
+                    if (amt := _norm_amount(num)) and amt >= 1000:
+                        return {"total": amt, "metodo": self.metodo, "evidencia": linea.strip()[:120]}
+        return None
+
+class ReglaVentana(Regla):
+    """
+    Línea con alguna de `claves` y el primer '$ número' en ella o en las `ventana - 1`
+    siguientes. Las ventanas abiertas se siguen en la misma pasada: el primer monto
+    válido dentro de alguna ventana corresponde a la primera clave que tiene uno.
+    """
+
+    def __init__(self, metodo: str, claves: List[str], ventana: int, evidencia: Tuple[int, int]):
+        super().__init__(metodo)
+        self.claves = tuple(claves)
+        self.ventana = ventana
+        self.evidencia = evidencia
+
+    def nuevo_estado(self):
+        return deque()
+
+    def linea(self, abiertas, i, linea, linea_up, lineas):
+        while abiertas and abiertas[0] + self.ventana <= i:
+            abiertas.popleft()
+        if any(k in linea_up for k in self.claves):
+            abiertas.append(i)
+        if abiertas and (amt := _ultimo_monto_pesos(linea)):
+            a, b = self.evidencia
+            return {"total": amt, "metodo": self.metodo, "evidencia": f"{lineas[abiertas[0]][:a]} → {linea[:b]}"}
+        return None
+
+class ReglaMaximo(Regla):
+    """Último recurso: el mayor '$ número' (>= 1000) de todo el texto."""
+    def nuevo_estado(self):
+        return []
+
+    def linea(self, maximo, i, linea, linea_up, lineas):
+        if "$" in linea:
+            for num in _RE_MONTO_PESOS.findall(linea):
+                if (amt := _norm_amount(num)) and amt >= 1000 and (not maximo or amt > maximo[0]):
+                    maximo[:] = [amt]
+        return None
+
+    def cierre(self, maximo):
+        if maximo:
+            return {"total": maximo[0], "metodo": self.metodo, "evidencia": "máximo con $"}
+        return None
+
+# 1. LETRAS → PRIORIDAD MÁXIMA (AHORA INCLUYE CASOS SIN "SON" NI "PESOS")
+REGLA_LETRAS = ReglaLetras("LETRAS (100% SEGURO)", [
+    r"\(\s*([A-ZÑ0-9\s/]+?)\s*\)",
+    r"VALOR EN LETRAS.*?([A-ZÑ0-9\s/]{20,})",
+    r"SON[:\.\s]*([A-ZÑ0-9\s/]{15,})",
+    r"([A-ZÑ0-9\s/]{20,})PESOS",
+    r"([A-ZÑ0-9\s/]{20,})PESO COLOMBIANO",
+    r"([A-ZÑ0-9\s/]{20,})\s*$",
+], anclados=(1, 2, 3, 4))
+
+REGLAS_LINEA = (
+    # 2. TOTAL: EN MISMA LÍNEA (CON O SIN $)
+    ReglaMismaLinea("TOTAL: EN MISMA LÍNEA", r"\bTOTAL\s*[:.]"),
+    # 3. VALOR TOTAL DE LA OPERACIÓN + 15 LÍNEAS
+    ReglaVentana("VALOR TOTAL OPERACIÓN",
+                 ["VALOR TOTAL DE LA OPERACIÓN", "TOTAL OPERACIÓN", "VALOR A PAGAR", "TOTAL NETO"],
+                 ventana=15, evidencia=(50, 50)),
     # 4. TOTAL FACTURA + 10 LÍNEAS
+    ReglaVentana("TOTAL_FACTURA_VERTICAL", ["TOTAL FACTURA", "TOTAL A PAGAR"],
+                 ventana=10, evidencia=(40, 40)),
+    # 5. ÚLTIMO RECURSO
+    ReglaMaximo("MAX_GLOBAL"),
+)
+
+# Versión de los resultados guardados en caché: cambia sola si cambian las reglas e
+# incluye el motor de texto y la franja, porque pueden cambiar las líneas que se ven.
+# _VERSION_CODIGO se sube a mano cuando cambia la lógica (normalización, lectura del PDF…)
+# 2: el atajo de la última página / franja solo acepta el valor en letras
+# 3: … y solo de los patrones anclados a un rótulo (ReglaLetras.anclados)
+_VERSION_CODIGO = "3"
+VERSION_EXTRACTOR = _VERSION_CODIGO + "-" + hashlib.sha1(
+    "\n".join([BACKEND, f"franja={EXTRAER_FRANJA if EXTRAER_RECORTE else '-'}"]
+              + [r.firma() for r in (REGLA_LETRAS, *REGLAS_LINEA)]).encode("utf-8")
+).hexdigest()[:12]
+
+# Casos en que el atajo sobre texto parcial (franja o última página) tenía que dar lo
+# mismo que el documento completo y no lo daba. Cada caso es la lista de líneas de cada página.
+_CASOS_ATAJO = [
+    # Anexo al final con un paréntesis en letras que no es el total (2.500.000)
+    [["FACTURA ELECTRONICA (CONTADO)", "SON: DOS MILLONES QUINIENTOS MIL PESOS M/CTE", "TOTAL: $ 2.500.000"],
+     ["ANEXO DETALLE", "Item 1 (MIL UNIDADES)"]],
+    # Una sola página: el paréntesis queda en la franja inferior y el "SON:" encima
+    [["FACTURA ELECTRONICA (CONTADO)", "SON: DOS MILLONES QUINIENTOS MIL PESOS M/CTE", "TOTAL: $ 2.500.000",
+      "DETALLE", "Item 1 (MIL UNIDADES)", "Item 2 $ 300"]],
+]
+
+def verificar_atajos() -> List[str]:
+    """
+    Comprueba _CASOS_ATAJO: lo que acepte el atajo sobre la última página (o cualquier
+    franja final de ella) debe ser el total del documento completo. Devuelve los fallos.
+    """
+    fallos = []
+    for n, paginas in enumerate(_CASOS_ATAJO, start=1):
+        esperado = _extraer_de_lineas([l for pagina in paginas for l in pagina])["total"]
+        ultima = paginas[-1]
+        for desde in range(len(ultima)):
+            parcial = _extraer_de_lineas(ultima[desde:], final=False)
+            if parcial is not None and parcial["total"] != esperado:
+                fallos.append(f"caso {n}: {parcial['total']} en lugar de {esperado} ({parcial['evidencia']})")
+                break
+    return fallos
+
+def _disparo(regla: Regla, resultado: dict) -> dict:
+    with _lock_disparos:
+        regla.disparos += 1
+    return resultado
+
+def estadisticas_reglas() -> dict:
+    """{método: veces que esa regla dio el total} en este proceso."""
+    return {r.metodo: r.disparos for r in (REGLA_LETRAS, *REGLAS_LINEA)}
+
+def _extraer_de_lineas(lineas: List[str], final: bool = True) -> Optional[dict]:
+    """
+    Aplica las reglas en orden de confianza. Con final=False (texto parcial: franja
+    o última página) solo se acepta el valor en letras de un patrón anclado y devuelve
+    None si no está; lo demás depende de lo que haya en el resto del documento.
+    """
+    texto_strip = "\n".join(lineas).upper().translate(_SIN_ACENTOS_NI_GUION)
+    if resultado := REGLA_LETRAS.documento(texto_strip, parcial=not final):
+        return _disparo(REGLA_LETRAS, resultado)
+    if not final:
+        return None
+
+    reglas = REGLAS_LINEA
+    estados = [r.nuevo_estado() for r in reglas]
+    resultados: List[Optional[dict]] = [None] * len(reglas)
     for i, linea in enumerate(lineas):
-        if any(x in linea.upper() for x in ["TOTAL FACTURA", "TOTAL A PAGAR"]):
-            for j in range(i, min(i+10, len(lineas))):
-                candidato = lineas[j]
-                if "$" in candidato:
-                    if nums := re.findall(r"\$\s*[\d.,]+", candidato):
-                        if amt := _norm_amount(nums[-1]):
-                            if amt >= 1000:
-                                return {"total": amt, "metodo": "TOTAL_FACTURA_VERTICAL", "evidencia": f"{linea[:40]} → {candidato[:40]}"}
+        linea_up = linea.upper()
+        for k, regla in enumerate(reglas):
+            if resultados[k] is None:
+                resultados[k] = regla.linea(estados[k], i, linea, linea_up, lineas)
+        if resultados[0] is not None:
+            break  # la regla más prioritaria ya resolvió
 
-    # 5. ÚLTIMO RECURSO
-    candidatos = []
-    for linea in lineas:
-        if "$" in linea:
-            for num in re.findall(r"\$\s*[\d.,]+", linea):
-                if amt := _norm_amount(num):
-                    if amt >= 1000:
-                        candidatos.append(amt)
-    if candidatos:
-        return {"total": max(candidatos), "metodo": "MAX_GLOBAL", "evidencia": "máximo con $"}
+    for k, regla in enumerate(reglas):
+        if resultado := resultados[k] or regla.cierre(estados[k]):
+            return _disparo(regla, resultado)
 
     return {"total": Decimal(0), "metodo": "FALLÓ", "evidencia": "nada"}
 
+def reevaluar_textos(guardar: bool = True) -> Iterator[Tuple[str, Optional[dict], Optional[dict]]]:
+    """
+    Vuelve a aplicar las reglas actuales al texto guardado en caché, sin reparsear
+    los PDFs (solo se abre el PDF si hace falta una página que no se guardó).
+    Devuelve (huella, resultado actual o None si no se pudo, resultado de otra versión
+    o None). Con guardar=True los resultados quedan en caché para la versión actual.
+    """
+    if (cache := _get_cache()) is None:
+        return
+    for huella, ruta in cache.documentos(BACKEND):
+        path = None
+        if ruta and Path(ruta).exists():
+            try:
+                path = Path(ruta) if cache.huella(ruta) == huella else None  # ¿sigue siendo el mismo PDF?
+            except OSError:
+                pass
+        try:
+            resultado = cache.obtener(huella, VERSION_EXTRACTOR)
+            if resultado is None:
+                resultado = _extraer_total_pdf(path, huella)
+                if guardar:
+                    cache.guardar(huella, VERSION_EXTRACTOR, resultado)
+        except TextoNoGuardado:
+            resultado = None
+        yield huella, resultado, cache.resultado_anterior(huella, VERSION_EXTRACTOR)
+
+def _informe_reevaluacion():
+    t0 = time.perf_counter()
+    n = sin_texto = cambios = 0
+    metodos: Dict[str, int] = {}
+    for huella, actual, anterior in reevaluar_textos():
+        n += 1
+        if actual is None:
+            sin_texto += 1
+            continue
+        metodos[actual["metodo"]] = metodos.get(actual["metodo"], 0) + 1
+        if anterior is not None and anterior["total"] != actual["total"]:
+            cambios += 1
+            print(f"[CAMBIO] {huella[:12]}: {anterior['total']} ({anterior['metodo']}) → "
+                  f"{actual['total']} ({actual['metodo']})")
+    print(f"\nReevaluados {n} documentos en {time.perf_counter() - t0:.2f}s "
+          f"(versión {VERSION_EXTRACTOR}, motor {BACKEND})")
+    print(f"  total distinto a la versión anterior: {cambios}")
+    print(f"  sin texto suficiente ni PDF:          {sin_texto}")
+    for metodo, k in sorted(metodos.items(), key=lambda x: -x[1]):
+        print(f"  {metodo:<28}{k}")
+
+# ====== Calibración de motores ======
+def calibrar_motores(paths: List[Path], referencia: str = "pdfplumber", guardar: bool = True) -> dict:
+    """
+    Extrae el total de `paths` con cada motor instalado (sin cachés), con y sin
+    franja, y elige la opción más rápida cuyos resultados son idénticos a los de
+    `referencia` sin franja. Con guardar=True la elección queda por defecto
+    (motor_pdf.json). La franja solo se ofrece si pasa verificar_atajos(): una
+    muestra al azar no cubre los casos en que el texto parcial engaña.
+    """
+    motores = disponibles()
+    ref = next((m for m in motores if m.nombre == referencia), None)
+    if ref is None:
+        raise RuntimeError(f"El motor de referencia {referencia!r} no está instalado")
+
+    opciones = [(ref, False)] + [(m, False) for m in motores if m is not ref]
+    if not verificar_atajos():
+        opciones += [(m, True) for m in motores if m.recorta]
+    informe: Dict[str, dict] = {}
+    esperados = None
+    for motor, recorte in opciones:
+        resultados, t0 = [], time.perf_counter()
+        for p in paths:
+            try:
+                resultados.append(_extraer_total_pdf(p, motor=motor, recorte=recorte))
+            except Exception as e:
+                resultados.append({"error": str(e)})
+        segundos = time.perf_counter() - t0
+        if esperados is None:
+            esperados = resultados
+        distintos = [str(p) for p, a, b in zip(paths, resultados, esperados) if a != b]
+        informe[motor.nombre + ("+franja" if recorte else "")] = {
+            "motor": motor.nombre, "recorte": recorte,
+            "clave": motor.clave, "segundos": round(segundos, 3),
+            "ms_por_pdf": round(1000 * segundos / max(1, len(paths)), 1),
+            "distintos": len(distintos), "ejemplos_distintos": distintos[:5],
+        }
+
+    validos = [n for n, r in informe.items() if r["distintos"] == 0]
+    elegido = min(validos, key=lambda n: informe[n]["segundos"])
+    motor, recorte = informe[elegido]["motor"], informe[elegido]["recorte"]
+    if guardar:
+        guardar_calibracion(motor, {"recorte": recorte, "franja": EXTRAER_FRANJA, "muestra": len(paths),
+                                    "referencia": referencia, "opciones": informe})
+    return {"motor": motor, "recorte": recorte, "opciones": informe}
+
+def _informe_calibracion(archivos: List[Path], muestra: int):
+    import random
+    if len(archivos) > muestra:
+        archivos = random.sample(archivos, muestra)
+    r = calibrar_motores(archivos)
+    print(f"{'opción':<20}{'ms/PDF':>9}{'distintos':>11}")
+    for nombre, info in r["opciones"].items():
+        print(f"{nombre:<20}{info['ms_por_pdf']:>9}{info['distintos']:>11}")
+    franja = " con franja" if r["recorte"] else ""
+    print(f"\nMotor elegido: {r['motor']}{franja} (muestra de {len(archivos)} PDFs)")
+
 # ====== MAIN ======
 def main():
     import argparse
     parser = argparse.ArgumentParser(description="Extractor")
     parser.add_argument("carpeta", nargs="?", default=str(DEFAULT_DIR))
+    parser.add_argument("--workers", type=int, default=None, help="Procesos de extracción (por defecto: núcleos)")
+    parser.add_argument("--reevaluar", action="store_true",
+                        help="Aplica las reglas actuales al texto ya guardado en caché y muestra los cambios")
+    parser.add_argument("--calibrar", action="store_true",
+                        help="Mide los motores de texto sobre la carpeta y deja por defecto el más rápido sin diferencias")
+    parser.add_argument("--muestra", type=int, default=200, help="PDFs usados para calibrar")
+    parser.add_argument("--verificar", action="store_true",
+                        help="Comprueba que el atajo de la última página da los totales del documento completo")
     args = parser.parse_args()
 
+    if args.verificar:
+        fallos = verificar_atajos()
+        print("\n".join(fallos) if fallos else f"Atajos correctos ({len(_CASOS_ATAJO)} casos).")
+        sys.exit(1 if fallos else 0)
+
+    if args.reevaluar:
+        _informe_reevaluacion()
+        return
+
     carpeta = Path(args.carpeta)
     archivos = list(carpeta.rglob("*.pdf"))
     if not archivos:
         return  
 
-    for pdf in archivos:
-        _ = extraer_total(pdf)
+    if args.calibrar:
+        _informe_calibracion(archivos, args.muestra)
+        return
+
+    from extraccion_lote import extraer_lote
+    for _ in extraer_lote(archivos, workers=args.workers, ordenado=False):
+        pass
 
 
 if __name__ == "__main__":
@@ -0,0 +1,311 @@
+from __future__ import annotations
+import re, sys, json, time, random, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+from rutas import LIB_PARTIAL_NAME, SUBCARPETA_SERVER_REL, COLUMNA_FACTURA_INTERNAL
+
+# === Servidor local que imita la parte de Microsoft Graph que usa buscar_facturas ===
+# Rutas atendidas (bajo /v1.0):
+#   GET  /sites/{site}/drives
+#   GET  /sites/{site}/drives/{drive}/list
+#   GET  /sites/{site}/lists/{list}/items?$expand&$filter&$top&$skiptoken
+#   GET  /sites/{site}/lists/{list}/items/delta
+#   GET  /sites/{site}/lists/{list}/items/{id}/driveItem/content  (Range / If-Range: 206 y 416)
+#   POST /$batch
+# $filter admite lo que genera buscar_facturas: eq, ge/le y startswith sobre FileDirRef.
+
+_RE_EQ = re.compile(r"fields/(\w+) eq '((?:[^']|'')*)'")
+_RE_GE = re.compile(r"fields/(\w+) ge '((?:[^']|'')*)'")
+_RE_LE = re.compile(r"fields/(\w+) le '((?:[^']|'')*)'")
+_RE_STARTSWITH = re.compile(r"startswith\(fields/(\w+), *'((?:[^']|'')*)'\)")
+_RE_RANGO = re.compile(r"bytes=(\d+)-(\d*)")
+
+LIST_ID = "lista-simulada"
+DRIVE_ID = "drive-simulado"
+OTRA_CARPETA = SUBCARPETA_SERVER_REL.rsplit("/", 1)[0] + "/OTRA_EMPRESA"
+
+# PDF mínimo para /driveItem/content (se rellena hasta tam_pdf)
+_PDF = b"%PDF-1.4\n1 0 obj<<>>endobj\ntrailer<<>>\n%%EOF\n"
+
+
+class _Servidor(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # el valor por defecto (5) descarta conexiones con muchos workers
+
+    def handle_error(self, request, client_address):
+        # El cliente cierra conexiones keep-alive al recrear su sesión: no es un error
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def _literal(valor: str) -> str:
+    return valor.replace("''", "'")
+
+
+class GraphSimulado:
+    """
+    Biblioteca sintética de `n_facturas` facturas PREFIJO+NÚMERO consecutivas servida por HTTP.
+    Una de cada `hueco_cada` facturas no existe (búsquedas negativas) y una fracción
+    `otras_carpetas` tiene además un archivo en la carpeta de otra empresa.
+    Simula latencia y throttling: 429 al azar (`prob_throttle`) o al superar `max_en_vuelo`
+    peticiones simultáneas. Con `prob_corte` una descarga de contenido se corta a mitad
+    del cuerpo (conexión cerrada), para probar la reanudación con Range; solo se reanuda
+    si el bloque de descarga del cliente es menor que lo recibido (ver --chunk-kb en
+    benchmark_busqueda).
+    """
+
+    def __init__(self, n_facturas: int = 1000, prefijo: str = "SMP", inicio: int = 10000,
+                 latencia_ms: float = 20.0, prob_throttle: float = 0.0, max_en_vuelo: int = 0,
+                 retry_after: float = 0.0, otras_carpetas: float = 0.3, hueco_cada: int = 10,
+                 tam_pdf: int = 50_000, pagina_max: int = 999, semilla: int = 1, puerto: int = 0,
+                 prob_corte: float = 0.0):
+        self.latencia = latencia_ms / 1000.0
+        self.prob_throttle = prob_throttle
+        self.prob_corte = prob_corte
+        self.max_en_vuelo = max_en_vuelo
+        self.retry_after = retry_after
+        self.pagina_max = pagina_max
+        self.pdf = _PDF + b"%" * max(0, tam_pdf - len(_PDF))
+        self._rand = random.Random(semilla)
+        self._lock = threading.Lock()
+        self.en_vuelo = 0
+        self.contadores: Dict[str, int] = {}
+
+        self.facturas = [f"{prefijo}{inicio + i}" for i in range(n_facturas)]
+        self.items: List[dict] = []
+        for i, fac in enumerate(self.facturas):
+            if hueco_cada and i % hueco_cada == hueco_cada - 1:
+                continue
+            carpetas = [SUBCARPETA_SERVER_REL]
+            if self._rand.random() < otras_carpetas:
+                carpetas.insert(0, OTRA_CARPETA)
+            for carpeta in carpetas:
+                item_id = str(len(self.items) + 1)
+                leaf = f"{fac}_{item_id}.pdf"
+                self.items.append({
+                    "id": item_id,
+                    "eTag": f'"{item_id},1"',
+                    "fields": {
+                        "FileRef": f"{carpeta}/{leaf}", "FileDirRef": carpeta,
+                        "FileLeafRef": leaf, COLUMNA_FACTURA_INTERNAL: fac,
+                    },
+                })
+        self.items.sort(key=lambda it: it["fields"][COLUMNA_FACTURA_INTERNAL])
+        self._por_id = {it["id"]: it for it in self.items}
+
+        self._server = _Servidor(("127.0.0.1", puerto), self._handler())
+        self._hilo: Optional[threading.Thread] = None
+
+    # -------------- Ciclo de vida --------------
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1.0"
+
+    def iniciar(self) -> "GraphSimulado":
+        self._hilo = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.detener()
+
+    # -------------- Contadores --------------
+    def _contar(self, clave: str, n: int = 1):
+        with self._lock:
+            self.contadores[clave] = self.contadores.get(clave, 0) + n
+
+    def reiniciar_contadores(self):
+        with self._lock:
+            self.contadores = {}
+
+    # -------------- Simulación --------------
+    def _throttle(self) -> bool:
+        """True si esta petición debe responder 429."""
+        with self._lock:
+            saturado = self.max_en_vuelo and self.en_vuelo > self.max_en_vuelo
+            return bool(saturado) or self._rand.random() < self.prob_throttle
+
+    def _cortar(self) -> bool:
+        """True si esta descarga debe cortarse a mitad del cuerpo."""
+        with self._lock:
+            return self._rand.random() < self.prob_corte
+
+    def _429(self):
+        self._contar("throttled")
+        cuerpo = {"error": {"code": "TooManyRequests", "message": "Simulated throttling"}}
+        return 429, {"Retry-After": str(self.retry_after)}, cuerpo
+
+    def resolver(self, method: str, ruta: str, body: Optional[dict] = None,
+                 headers: Optional[dict] = None):
+        """Atiende una petición (directa o dentro de $batch). Devuelve (status, headers, cuerpo)."""
+        partes = urlsplit(ruta)
+        path = partes.path[len("/v1.0"):] if partes.path.startswith("/v1.0") else partes.path
+        query = {k: v[-1] for k, v in parse_qs(partes.query, keep_blank_values=True).items()}
+        seg = [s for s in path.split("/") if s]
+
+        if method == "POST" and seg == ["$batch"]:
+            return self._batch(body or {})
+        if self._throttle():
+            return self._429()
+
+        if len(seg) == 3 and seg[0] == "sites" and seg[2] == "drives":
+            self._contar("drives")
+            return 200, {}, {"value": [{"id": DRIVE_ID, "name": LIB_PARTIAL_NAME}]}
+        if len(seg) == 5 and seg[2] == "drives" and seg[4] == "list":
+            self._contar("list")
+            return 200, {}, {"id": LIST_ID, "name": "Lista simulada"}
+        if len(seg) == 5 and seg[2] == "lists" and seg[4] == "items":
+            self._contar("items")
+            return 200, {}, self._items(path, query)
+        if len(seg) == 6 and seg[4] == "items" and seg[5] == "delta":
+            self._contar("delta")
+            return 200, {}, self._delta(path, query)
+        if len(seg) == 8 and seg[4] == "items" and seg[6:] == ["driveItem", "content"]:
+            self._contar("content")
+            if seg[5] not in self._por_id:
+                return 404, {}, {"error": {"code": "itemNotFound", "message": "Item not found"}}
+            return self._contenido(self._por_id[seg[5]], headers or {})
+
+        self._contar("404")
+        return 404, {}, {"error": {"code": "itemNotFound", "message": f"Ruta no simulada: {path}"}}
+
+    def _pagina(self, path: str, query: dict, items: List[dict], fin: Optional[dict] = None):
+        top = min(int(query.get("$top") or 200), self.pagina_max)
+        desde = int(query.get("$skiptoken") or 0)
+        respuesta = {"value": items[desde:desde + top]}
+        if desde + top < len(items):
+            siguiente = dict(query, **{"$skiptoken": str(desde + top)})
+            respuesta["@odata.nextLink"] = f"{self.url}{path}?{urlencode(siguiente)}"
+        elif fin:
+            respuesta.update(fin)
+        return respuesta
+
+    def _items(self, path: str, query: dict) -> dict:
+        filtro = query.get("$filter", "")
+        items = self.items
+        m = _RE_EQ.search(filtro)
+        if m:
+            col, valor = m.group(1), _literal(m.group(2)).upper()
+            items = [it for it in items if str(it["fields"].get(col, "")).upper() == valor]
+        ge, le = _RE_GE.search(filtro), _RE_LE.search(filtro)
+        if ge:
+            items = [it for it in items if str(it["fields"].get(ge.group(1), "")).upper() >= _literal(ge.group(2)).upper()]
+        if le:
+            items = [it for it in items if str(it["fields"].get(le.group(1), "")).upper() <= _literal(le.group(2)).upper()]
+        sw = _RE_STARTSWITH.search(filtro)
+        if sw:
+            col, prefijo = sw.group(1), _literal(sw.group(2))
+            items = [it for it in items if str(it["fields"].get(col, "")).startswith(prefijo)]
+        return self._pagina(path, query, items)
+
+    def _delta(self, path: str, query: dict) -> dict:
+        if query.get("token") == "fin":
+            return {"value": [], "@odata.deltaLink": f"{self.url}{path}?token=fin"}
+        return self._pagina(path, query, self.items, fin={"@odata.deltaLink": f"{self.url}{path}?token=fin"})
+
+    def _contenido(self, item: dict, headers: dict):
+        """PDF del ítem; con Range (y If-Range igual al ETag) solo el trozo pedido."""
+        base = {"Content-Type": "application/pdf", "ETag": item["eTag"], "Accept-Ranges": "bytes"}
+        total = len(self.pdf)
+        m = _RE_RANGO.fullmatch((headers.get("Range") or "").strip())
+        if_range = headers.get("If-Range")
+        if not m or (if_range is not None and if_range != item["eTag"]):
+            return 200, base, self.pdf
+        desde = int(m.group(1))
+        hasta = min(int(m.group(2)) if m.group(2) else total - 1, total - 1)
+        if desde >= total or desde > hasta:
+            self._contar("content_416")
+            return 416, {"Content-Range": f"bytes */{total}"}, {
+                "error": {"code": "invalidRange", "message": "Requested range not satisfiable"}}
+        self._contar("content_206")
+        return 206, dict(base, **{"Content-Range": f"bytes {desde}-{hasta}/{total}"}), self.pdf[desde:hasta + 1]
+
+    def _batch(self, body: dict):
+        self._contar("batch")
+        respuestas = []
+        for sub in body.get("requests", []):
+            self._contar("sub_batch")
+            status, headers, cuerpo = self.resolver(sub.get("method", "GET"), sub.get("url", ""),
+                                                    headers=sub.get("headers"))
+            respuestas.append({"id": sub.get("id"), "status": status, "headers": headers, "body": cuerpo})
+        time.sleep(self.latencia * 0.1 * len(respuestas))  # cada sub-petición suma algo de trabajo
+        return 200, {}, {"responses": respuestas}
+
+    # -------------- HTTP --------------
+    def _handler(self):
+        simulado = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _atender(self, method):
+                largo = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(largo) or b"{}") if largo else None
+                with simulado._lock:
+                    simulado.en_vuelo += 1
+                try:
+                    time.sleep(simulado.latencia * (0.5 + simulado._rand.random()))
+                    status, headers, cuerpo = simulado.resolver(method, self.path, body, self.headers)
+                finally:
+                    with simulado._lock:
+                        simulado.en_vuelo -= 1
+                datos = cuerpo if isinstance(cuerpo, bytes) else json.dumps(cuerpo).encode("utf-8")
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                if not isinstance(cuerpo, bytes):
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(datos)))
+                self.end_headers()
+                if isinstance(cuerpo, bytes) and len(datos) > 1 and simulado._cortar():
+                    # Se envía la mitad y se cierra: el cliente ve un cuerpo incompleto
+                    simulado._contar("cortes")
+                    self.wfile.write(datos[:len(datos) // 2])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(datos)
+
+            def do_GET(self):
+                self._atender("GET")
+
+            def do_POST(self):
+                self._atender("POST")
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+# Uso directo por consola: deja el servidor escuchando
+if __name__ == "__main__":
+    import argparse
+
+    p = argparse.ArgumentParser(description="Servidor Graph simulado para pruebas de rendimiento")
+    p.add_argument("--facturas", type=int, default=1000)
+    p.add_argument("--puerto", type=int, default=8765)
+    p.add_argument("--latencia-ms", type=float, default=20.0)
+    p.add_argument("--throttle", type=float, default=0.0, help="Probabilidad de responder 429")
+    p.add_argument("--max-en-vuelo", type=int, default=0, help="429 por encima de este número de peticiones simultáneas")
+    p.add_argument("--corte", type=float, default=0.0, help="Probabilidad de cortar una descarga a mitad del cuerpo")
+    args = p.parse_args()
+
+    g = GraphSimulado(args.facturas, latencia_ms=args.latencia_ms, prob_throttle=args.throttle,
+                      max_en_vuelo=args.max_en_vuelo, puerto=args.puerto, prob_corte=args.corte).iniciar()
+    print(f"Graph simulado en {g.url} ({len(g.facturas)} facturas, {len(g.items)} ítems). Ctrl+C para salir.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        g.detener()
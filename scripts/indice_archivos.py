@@ -0,0 +1,216 @@
+from __future__ import annotations
+import os, re, json, time, threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+# === Índice de nombres de archivo en las carpetas sincronizadas de OneDrive ===
+def clave_factura(texto: str) -> str:
+    """Clave normalizada de una factura: mayúsculas, solo letras y dígitos ('smp-14931' → 'SMP14931')."""
+    return re.sub(r"[^0-9A-Z]", "", str(texto).upper())
+
+def _misma_carpeta(local: str, remota: str) -> bool:
+    """Nombre de carpeta local equivalente al de SharePoint (OneDrive sincroniza 'Sitio - Carpeta')."""
+    local, remota = local.lower(), remota.lower()
+    return local == remota or local.endswith(" - " + remota)
+
+class IndiceArchivos:
+    """
+    Mapa nombre de archivo → rutas locales para todas las subcarpetas de `bases`.
+    Si un nombre aparece en varias carpetas, la carpeta de SharePoint del archivo
+    decide cuál corresponde (ver buscar).
+
+    La primera vez recorre cada base con os.scandir; después solo vuelve a listar
+    las carpetas cuyo mtime cambió (se agregó, borró o renombró algo en ellas).
+    El estado se guarda en `cache_path` para reutilizarlo entre ejecuciones.
+    """
+
+    def __init__(self, bases: Iterable[Path], cache_path: Optional[Path] = None, refresco_min: float = 10.0):
+        self.bases = [str(Path(b)) for b in bases]
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.refresco_min = refresco_min
+        self._lock = threading.Lock()
+        # carpeta → {"mtime": ns, "archivos": [...], "subdirs": [...]}
+        self._dirs: Dict[str, dict] = {}
+        self._por_nombre: Dict[str, List[str]] = {}
+        self._por_clave: Dict[str, List[str]] = {}
+        self._ultimo: Optional[float] = None
+        self._cargar()
+
+    # -------------- Persistencia --------------
+    def _cargar(self):
+        if not self.cache_path:
+            return
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("bases") == self.bases:
+                self._dirs = data.get("dirs", {})
+                self._reindexar()
+        except Exception:
+            self._dirs = {}
+
+    def _guardar(self):
+        if not self.cache_path:
+            return
+        try:
+            tmp = self.cache_path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"bases": self.bases, "dirs": self._dirs}, f, ensure_ascii=False)
+            os.replace(tmp, self.cache_path)
+        except Exception:
+            pass  # best-effort
+
+    # -------------- Recorrido --------------
+    @staticmethod
+    def _listar(carpeta: str):
+        archivos, subdirs = [], []
+        with os.scandir(carpeta) as it:
+            for e in it:
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        subdirs.append(e.name)
+                    elif e.is_file():
+                        archivos.append(e.name)
+                except OSError:
+                    continue
+        return archivos, subdirs
+
+    def actualizar(self):
+        """Revisa el mtime de cada carpeta conocida y vuelve a listar solo las que cambiaron."""
+        with self._lock:
+            vistas, cambios = set(), False
+            pila = [b for b in reversed(self.bases) if os.path.isdir(b)]
+            while pila:
+                carpeta = pila.pop()
+                if carpeta in vistas:
+                    continue
+                vistas.add(carpeta)
+                try:
+                    mtime = os.stat(carpeta).st_mtime_ns
+                except OSError:
+                    continue
+                entrada = self._dirs.get(carpeta)
+                if entrada is None or entrada["mtime"] != mtime:
+                    try:
+                        archivos, subdirs = self._listar(carpeta)
+                    except OSError:
+                        continue
+                    entrada = {"mtime": mtime, "archivos": archivos, "subdirs": subdirs}
+                    self._dirs[carpeta] = entrada
+                    cambios = True
+                pila.extend(os.path.join(carpeta, s) for s in reversed(entrada["subdirs"]))
+
+            for carpeta in [d for d in self._dirs if d not in vistas]:
+                del self._dirs[carpeta]
+                cambios = True
+
+            if cambios:
+                self._reindexar()
+                self._guardar()
+            self._ultimo = time.monotonic()
+
+    def _rango(self, carpeta: str):
+        """Prioridad de una carpeta: orden de la base en ONEDRIVE_BASE y luego profundidad."""
+        for i, base in enumerate(self.bases):
+            if carpeta == base or carpeta.startswith(base.rstrip(os.sep) + os.sep):
+                return i, carpeta.count(os.sep) - base.count(os.sep), carpeta
+        return len(self.bases), 0, carpeta
+
+    def _reindexar(self):
+        por_nombre: Dict[str, list] = {}
+        por_clave: Dict[str, list] = {}
+        for carpeta, entrada in self._dirs.items():
+            rango = self._rango(carpeta)
+            for nombre in entrada["archivos"]:
+                ruta = os.path.join(carpeta, nombre)
+                por_nombre.setdefault(nombre.lower(), []).append((rango, ruta))
+                stem, ext = os.path.splitext(nombre)
+                if ext.lower() == ".pdf":
+                    clave = clave_factura(stem)
+                    if clave:
+                        por_clave.setdefault(clave, []).append((rango, ruta))
+        # Candidatos en orden de prioridad de carpeta (_rango)
+        self._por_nombre = {k: [ruta for _, ruta in sorted(v)] for k, v in por_nombre.items()}
+        self._por_clave = {k: [ruta for _, ruta in sorted(v)] for k, v in por_clave.items()}
+
+    # -------------- Consulta --------------
+    def _consultar(self, mapa: str, clave: str) -> List[str]:
+        """
+        Candidatos de `clave` en el mapa indicado. Ante un fallo vuelve a revisar las
+        carpetas, como mucho cada `refresco_min` segundos; si algún archivo indexado ya
+        no existe, las revisa de inmediato.
+        """
+        if self._ultimo is None:
+            self.actualizar()
+        rutas = getattr(self, mapa).get(clave, [])
+        if any(not os.path.exists(r) for r in rutas):
+            self.actualizar()
+            rutas = getattr(self, mapa).get(clave, [])
+        elif not rutas and time.monotonic() - self._ultimo >= self.refresco_min:
+            self.actualizar()
+            rutas = getattr(self, mapa).get(clave, [])
+        return rutas
+
+    @staticmethod
+    def _elegir(rutas: List[str], carpeta: Optional[str]) -> Optional[Path]:
+        """
+        Un único candidato se acepta tal cual. Con varios, gana el que comparte más
+        carpetas finales con `carpeta` (ruta en SharePoint relativa a la biblioteca,
+        p. ej. 'FANALCA/2024'); sin `carpeta` o si hay empate, es ambiguo: None.
+        """
+        if len(rutas) == 1:
+            return Path(rutas[0])
+        partes = [p for p in (carpeta or "").replace("\\", "/").split("/") if p]
+        if not rutas or not partes:
+            return None
+
+        def coincidencias(ruta):
+            locales = Path(ruta).parent.parts
+            n = 0
+            while n < min(len(partes), len(locales)) and _misma_carpeta(locales[-1 - n], partes[-1 - n]):
+                n += 1
+            return n
+
+        puntos = sorted(((coincidencias(r), r) for r in rutas), key=lambda x: x[0], reverse=True)
+        if puntos[0][0] == 0 or puntos[0][0] == puntos[1][0]:
+            return None
+        return Path(puntos[0][1])
+
+    def candidatos(self, nombre: str) -> List[Path]:
+        """Todas las rutas locales con el nombre de archivo `nombre` (sin distinguir mayúsculas)."""
+        return [Path(r) for r in self._consultar("_por_nombre", nombre.lower())]
+
+    def buscar(self, nombre: str, carpeta: Optional[str] = None) -> Optional[Path]:
+        """
+        Ruta local del archivo `nombre` (sin distinguir mayúsculas) o None. Si hay varios
+        con ese nombre, `carpeta` (su carpeta en SharePoint) elige entre ellos (ver _elegir).
+        """
+        return self._elegir(self._consultar("_por_nombre", nombre.lower()), carpeta)
+
+    @staticmethod
+    def _bajo_carpeta(ruta: str, carpeta: str) -> bool:
+        """True si alguna secuencia de carpetas de `ruta` equivale a `carpeta` ('FANALCA/2024')."""
+        partes = [p for p in carpeta.replace("\\", "/").split("/") if p]
+        locales = Path(ruta).parent.parts
+        return bool(partes) and any(
+            all(_misma_carpeta(locales[i + k], parte) for k, parte in enumerate(partes))
+            for i in range(len(locales) - len(partes) + 1)
+        )
+
+    def buscar_factura(self, factura: str, refrescar: bool = True, carpeta: Optional[str] = None) -> Optional[Path]:
+        """
+        PDF local cuyo nombre corresponde a la factura (p. ej. 'SMP14931' → '.../SMP14931.pdf'),
+        comparando claves normalizadas. Con refrescar=False no revisa carpetas ante un fallo.
+        Si hay varios, solo vale el único que esté bajo `carpeta` (relativa a la biblioteca);
+        si no hay uno solo, es ambiguo y devuelve None.
+        """
+        clave = clave_factura(factura)
+        if not clave:
+            return None
+        if not refrescar and self._ultimo is not None:
+            rutas = [r for r in self._por_clave.get(clave, []) if os.path.exists(r)]
+        else:
+            rutas = self._consultar("_por_clave", clave)
+        if len(rutas) > 1 and carpeta:
+            rutas = [r for r in rutas if self._bajo_carpeta(r, carpeta)]
+        return Path(rutas[0]) if len(rutas) == 1 else None
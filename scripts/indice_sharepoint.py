@@ -0,0 +1,218 @@
+from __future__ import annotations
+import sqlite3, sys, json, time, threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# === Índice local (SQLite) de la biblioteca de facturas ===
+if getattr(sys, "frozen", False):
+    BASE_DIR = Path(sys.executable).parent
+else:
+    BASE_DIR = Path(__file__).resolve().parent
+
+INDICE_PATH = BASE_DIR / "indice_sharepoint.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    list_id       TEXT NOT NULL,
+    item_id       TEXT NOT NULL,
+    factura       TEXT COLLATE NOCASE,
+    file_ref      TEXT,
+    file_dir_ref  TEXT,
+    file_leaf_ref TEXT,
+    etag          TEXT,
+    PRIMARY KEY (list_id, item_id)
+);
+CREATE INDEX IF NOT EXISTS ix_items_factura ON items (list_id, factura);
+CREATE TABLE IF NOT EXISTS estado (
+    list_id     TEXT PRIMARY KEY,
+    delta_link  TEXT,
+    actualizado REAL
+);
+CREATE TABLE IF NOT EXISTS consultas (
+    site_id  TEXT NOT NULL,
+    list_id  TEXT NOT NULL,
+    columna  TEXT NOT NULL,
+    factura  TEXT NOT NULL,
+    items    TEXT NOT NULL,
+    ts       REAL NOT NULL,
+    PRIMARY KEY (site_id, list_id, columna, factura)
+);
+"""
+
+# SQLite limita los parámetros por consulta
+_MAX_PARAMS = 500
+
+
+class _BaseSQLite:
+    """Conexión por operación al archivo del índice (seguro entre hilos) y esquema común."""
+
+    def __init__(self, path: str | Path = INDICE_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        with self._conexion() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(_SCHEMA)
+
+    @contextmanager
+    def _conexion(self):
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            yield con
+            con.commit()
+        finally:
+            con.close()
+
+
+class IndiceFacturas(_BaseSQLite):
+    """
+    Copia local de Factura → FileRef/FileDirRef/FileLeafRef/eTag por lista.
+    Se alimenta con la API delta de Graph (ver buscar_facturas.sincronizar_indice).
+    """
+
+    # -------------- Estado de sincronización --------------
+    def delta_link(self, list_id: str) -> Optional[str]:
+        with self._conexion() as con:
+            row = con.execute("SELECT delta_link FROM estado WHERE list_id = ?", (list_id,)).fetchone()
+        return row[0] if row else None
+
+    def sincronizado(self, list_id: str) -> bool:
+        return self.delta_link(list_id) is not None
+
+    def guardar_delta(self, list_id: str, delta_link: str):
+        with self._lock, self._conexion() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO estado (list_id, delta_link, actualizado) VALUES (?, ?, ?)",
+                (list_id, delta_link, time.time()),
+            )
+
+    def limpiar(self, list_id: str):
+        """Borra ítems y estado de la lista (antes de una sincronización completa)."""
+        with self._lock, self._conexion() as con:
+            con.execute("DELETE FROM items WHERE list_id = ?", (list_id,))
+            con.execute("DELETE FROM estado WHERE list_id = ?", (list_id,))
+
+    # -------------- Escritura --------------
+    def aplicar(self, list_id: str, col_internal: str, items: Iterable[dict]) -> int:
+        """Aplica una página de la respuesta delta (altas, cambios y bajas)."""
+        altas, bajas = [], []
+        for it in items:
+            item_id = str(it.get("id", ""))
+            if not item_id:
+                continue
+            if "@removed" in it or "deleted" in it:
+                bajas.append((list_id, item_id))
+                continue
+            fields = it.get("fields") or {}
+            factura = fields.get(col_internal)
+            altas.append((
+                list_id, item_id,
+                str(factura).strip() if factura is not None else None,
+                fields.get("FileRef"), fields.get("FileDirRef"), fields.get("FileLeafRef"),
+                it.get("eTag"),
+            ))
+
+        with self._lock, self._conexion() as con:
+            con.executemany("DELETE FROM items WHERE list_id = ? AND item_id = ?", bajas)
+            con.executemany(
+                "INSERT OR REPLACE INTO items "
+                "(list_id, item_id, factura, file_ref, file_dir_ref, file_leaf_ref, etag) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                altas,
+            )
+        return len(altas) + len(bajas)
+
+    # -------------- Consulta --------------
+    def buscar(self, list_id: str, col_internal: str, facturas: Iterable[str]) -> Dict[str, List[dict]]:
+        """
+        Devuelve {factura: [ítems]} con la misma forma que la API de Graph
+        (id, eTag y fields), solo para las facturas presentes en el índice.
+        """
+        pedidas = {str(f).strip().upper(): f for f in facturas}
+        claves = list(pedidas)
+        resultado: Dict[str, List[dict]] = {}
+
+        with self._conexion() as con:
+            for k in range(0, len(claves), _MAX_PARAMS):
+                grupo = claves[k:k + _MAX_PARAMS]
+                marcas = ",".join("?" * len(grupo))
+                rows = con.execute(
+                    "SELECT factura, item_id, etag, file_ref, file_dir_ref, file_leaf_ref FROM items "
+                    f"WHERE list_id = ? AND factura IN ({marcas}) ORDER BY item_id",
+                    (list_id, *grupo),
+                ).fetchall()
+                for factura, item_id, etag, file_ref, file_dir_ref, file_leaf_ref in rows:
+                    original = pedidas.get(factura.upper())
+                    if original is None:
+                        continue
+                    resultado.setdefault(original, []).append({
+                        "id": item_id,
+                        "eTag": etag,
+                        "fields": {
+                            "FileRef": file_ref,
+                            "FileDirRef": file_dir_ref,
+                            "FileLeafRef": file_leaf_ref,
+                            col_internal: factura,
+                        },
+                    })
+        return resultado
+
+    def total(self, list_id: str) -> int:
+        with self._conexion() as con:
+            return con.execute("SELECT COUNT(*) FROM items WHERE list_id = ?", (list_id,)).fetchone()[0]
+
+
+# Clave de una consulta: (site_id, list_id, columna, factura normalizada)
+ClaveConsulta = Tuple[str, str, str, str]
+
+
+class CacheConsultas(_BaseSQLite):
+    """
+    Resultados de consultas por factura a Graph, positivos y negativos (lista vacía),
+    con vigencia distinta para cada caso. Comparte el archivo SQLite del índice.
+    """
+
+    def obtener(self, claves: Iterable[ClaveConsulta], ttl_positivo: float, ttl_negativo: float) -> Dict[ClaveConsulta, list]:
+        """{clave: ítems} de las claves con resultado vigente (ttl en segundos)."""
+        ahora = time.time()
+        resultado = {}
+        with self._conexion() as con:
+            for clave in claves:
+                row = con.execute(
+                    "SELECT items, ts FROM consultas WHERE site_id = ? AND list_id = ? AND columna = ? AND factura = ?",
+                    clave,
+                ).fetchone()
+                if not row:
+                    continue
+                items = json.loads(row[0])
+                if ahora - row[1] < (ttl_positivo if items else ttl_negativo):
+                    resultado[clave] = items
+        return resultado
+
+    def guardar(self, resultados: Dict[ClaveConsulta, list]):
+        ahora = time.time()
+        with self._lock, self._conexion() as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO consultas (site_id, list_id, columna, factura, items, ts) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(*clave, json.dumps(items, ensure_ascii=False), ahora) for clave, items in resultados.items()],
+            )
+
+    def invalidar(self, claves: Iterable[ClaveConsulta]):
+        with self._lock, self._conexion() as con:
+            con.executemany(
+                "DELETE FROM consultas WHERE site_id = ? AND list_id = ? AND columna = ? AND factura = ?",
+                list(claves),
+            )
+
+
+# Uso directo por consola: sincroniza el índice
+if __name__ == "__main__":
+    import argparse
+    from buscar_facturas import sincronizar_indice
+
+    p = argparse.ArgumentParser(description="Sincronizar índice local de facturas (Graph delta)")
+    p.add_argument("--completo", action="store_true", help="Descarta el índice y lo reconstruye desde cero")
+    args = p.parse_args()
+
+    sincronizar_indice(on_progress=print, completo=args.completo)
@@ -0,0 +1,279 @@
+from __future__ import annotations
+import os, sys, json, threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# === Motores de texto para PDFs ===
+# Todos devuelven el texto de una página; extraer_TotalFactura lo parte en líneas.
+# pdfplumber es el de siempre; pdfium (pypdfium2) y PyMuPDF son nativos y mucho
+# más rápidos. `extraer_TotalFactura.py --calibrar` elige el más rápido que da los
+# mismos totales que pdfplumber y lo deja guardado en MOTOR_PATH.
+if getattr(sys, "frozen", False):
+    BASE_DIR = Path(sys.executable).parent
+else:
+    BASE_DIR = Path(__file__).resolve().parent
+
+MOTOR_PATH = BASE_DIR / "motor_pdf.json"
+
+
+class DocumentoTexto:
+    """PDF abierto por un motor: número de páginas y texto de cada una."""
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def texto(self, i: int) -> str:
+        raise NotImplementedError
+
+    def texto_region(self, i: int, desde: float) -> Optional[str]:
+        """
+        Texto de la franja inferior de la página i, desde la fracción `desde` de la
+        altura (0 = borde superior) hasta el final. None si el motor no sabe recortar.
+        """
+        return None
+
+    def cerrar(self):
+        pass
+
+
+class MotorTexto:
+    """Motor de extracción de texto. `clave` identifica motor y versión (p. ej. en cachés)."""
+    nombre = ""
+    recorta = False  # sus documentos implementan texto_region
+
+    def __init__(self):
+        self.version = self._version()
+
+    def _version(self) -> Optional[str]:
+        """Versión de la librería, o None si no está instalada."""
+        raise NotImplementedError
+
+    @property
+    def disponible(self) -> bool:
+        return self.version is not None
+
+    @property
+    def clave(self) -> str:
+        return f"{self.nombre}-{self.version}"
+
+    def abrir(self, path: Path) -> DocumentoTexto:
+        raise NotImplementedError
+
+
+# ====== pdfplumber ======
+class _DocPdfplumber(DocumentoTexto):
+    def __init__(self, path):
+        import pdfplumber
+        self._pdf = pdfplumber.open(path)
+
+    def __len__(self):
+        return len(self._pdf.pages)
+
+    def texto(self, i):
+        page = self._pdf.pages[i]
+        texto = page.extract_text() or ""
+        getattr(page, "close", lambda: None)()  # libera lo ya procesado de la página
+        return texto
+
+    def texto_region(self, i, desde):
+        page = self._pdf.pages[i]
+        if page.rotation:
+            return None
+        x0, top, x1, bottom = page.bbox
+        # La página no se cierra: si hace falta el texto completo, reutiliza lo ya leído
+        return page.crop((x0, top + (bottom - top) * desde, x1, bottom)).extract_text() or ""
+
+    def cerrar(self):
+        self._pdf.close()
+
+class MotorPdfplumber(MotorTexto):
+    nombre = "pdfplumber"
+    recorta = True
+
+    def _version(self):
+        try:
+            import pdfplumber
+            return getattr(pdfplumber, "__version__", "?")
+        except Exception:
+            return None
+
+    def abrir(self, path):
+        return _DocPdfplumber(path)
+
+
+# ====== pdfminer ======
+class _DocPdfminer(DocumentoTexto):
+    def __init__(self, path):
+        from pdfminer.pdfpage import PDFPage
+        self.path = str(path)
+        with open(self.path, "rb") as f:
+            self._total = sum(1 for _ in PDFPage.get_pages(f))
+
+    def __len__(self):
+        return self._total
+
+    def texto(self, i):
+        from pdfminer.high_level import extract_text
+        return extract_text(self.path, page_numbers=[i])
+
+class MotorPdfminer(MotorTexto):
+    nombre = "pdfminer"
+
+    def _version(self):
+        try:
+            import pdfminer
+            return getattr(pdfminer, "__version__", "?")
+        except Exception:
+            return None
+
+    def abrir(self, path):
+        return _DocPdfminer(path)
+
+
+# ====== pdfium (pypdfium2) ======
+# PDFium no admite llamadas simultáneas desde varios hilos del mismo proceso
+_lock_pdfium = threading.Lock()
+
+class _DocPdfium(DocumentoTexto):
+    def __init__(self, path):
+        import pypdfium2
+        with _lock_pdfium:
+            self._pdf = pypdfium2.PdfDocument(str(path))
+            self._total = len(self._pdf)
+
+    def __len__(self):
+        return self._total
+
+    def texto(self, i):
+        with _lock_pdfium:
+            page = self._pdf[i]
+            textpage = page.get_textpage()
+            try:
+                return textpage.get_text_bounded() or ""
+            finally:
+                textpage.close()
+                page.close()
+
+    def texto_region(self, i, desde):
+        with _lock_pdfium:
+            page = self._pdf[i]
+            try:
+                if page.get_rotation():
+                    return None
+                # Coordenadas PDF: el origen está abajo, así que la franja va de `bottom` hacia arriba
+                left, bottom, right, top = page.get_bbox()
+                textpage = page.get_textpage()
+                try:
+                    return textpage.get_text_bounded(left, bottom, right, top - (top - bottom) * desde) or ""
+                finally:
+                    textpage.close()
+            finally:
+                page.close()
+
+    def cerrar(self):
+        with _lock_pdfium:
+            self._pdf.close()
+
+class MotorPdfium(MotorTexto):
+    nombre = "pdfium"
+    recorta = True
+
+    def _version(self):
+        try:
+            import pypdfium2
+            return str(pypdfium2.version.PYPDFIUM_INFO)
+        except Exception:
+            return None
+
+    def abrir(self, path):
+        return _DocPdfium(path)
+
+
+# ====== PyMuPDF (opcional) ======
+class _DocPymupdf(DocumentoTexto):
+    def __init__(self, path):
+        import fitz
+        self._pdf = fitz.open(str(path))
+
+    def __len__(self):
+        return self._pdf.page_count
+
+    def texto(self, i):
+        return self._pdf[i].get_text() or ""
+
+    def texto_region(self, i, desde):
+        import fitz
+        page = self._pdf[i]
+        if page.rotation:
+            return None
+        r = page.rect
+        return page.get_text(clip=fitz.Rect(r.x0, r.y0 + r.height * desde, r.x1, r.y1)) or ""
+
+    def cerrar(self):
+        self._pdf.close()
+
+class MotorPymupdf(MotorTexto):
+    nombre = "pymupdf"
+    recorta = True
+
+    def _version(self):
+        try:
+            import fitz
+            return getattr(fitz, "VersionBind", None) or getattr(fitz, "__version__", "?")
+        except Exception:
+            return None
+
+    def abrir(self, path):
+        return _DocPymupdf(path)
+
+
+# ====== Selección ======
+# Orden de preferencia sin calibrar: el comportamiento histórico primero
+MOTORES: Dict[str, MotorTexto] = {m.nombre: m for m in (
+    MotorPdfplumber(), MotorPdfminer(), MotorPdfium(), MotorPymupdf(),
+)}
+
+
+def disponibles() -> List[MotorTexto]:
+    return [m for m in MOTORES.values() if m.disponible]
+
+
+def motor_calibrado() -> Optional[str]:
+    """Nombre del motor guardado por la última calibración, si sigue instalado."""
+    try:
+        with open(MOTOR_PATH, "r", encoding="utf-8") as f:
+            nombre = json.load(f).get("motor")
+    except (OSError, ValueError):
+        return None
+    return nombre if nombre in MOTORES and MOTORES[nombre].disponible else None
+
+
+def recorte_calibrado() -> bool:
+    """True si la última calibración validó la extracción por franja (ver extraer_TotalFactura)."""
+    try:
+        with open(MOTOR_PATH, "r", encoding="utf-8") as f:
+            return bool(json.load(f).get("recorte"))
+    except (OSError, ValueError):
+        return False
+
+
+def guardar_calibracion(nombre: str, detalle: dict):
+    with open(MOTOR_PATH, "w", encoding="utf-8") as f:
+        json.dump({"motor": nombre, **detalle}, f, ensure_ascii=False, indent=2)
+
+
+def elegir_motor(nombre: Optional[str] = None) -> MotorTexto:
+    """
+    Motor a usar: el pedido (o PDF_MOTOR), si no el calibrado y si no el primero
+    instalado en el orden de MOTORES.
+    """
+    if nombre and nombre not in MOTORES:
+        raise ValueError(f"Motor PDF desconocido: {nombre!r} (opciones: {', '.join(MOTORES)})")
+    # Un PDF_MOTOR mal escrito o no instalado no impide extraer: se sigue con el resto
+    for candidato in (nombre, (os.getenv("PDF_MOTOR") or "").strip().lower(), motor_calibrado()):
+        if candidato in MOTORES and MOTORES[candidato].disponible:
+            return MOTORES[candidato]
+    for motor in MOTORES.values():
+        if motor.disponible:
+            return motor
+    raise RuntimeError("No hay ninguna librería de lectura de PDF instalada (pdfplumber, pdfminer.six, pypdfium2)")
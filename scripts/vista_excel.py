@@ -24,6 +24,7 @@ except Exception as e:
     raise SystemExit("Se requiere 'pandas'. Instala con: pip install pandas openpyxl")
 
 import threading
+import multiprocessing
 from comparador_facturas import comparar_desde_excel
 from extraer_TotalFactura import DEFAULT_DIR as DEFAULT_PDF_DIR
 
@@ -646,6 +647,7 @@ class ExcelTableViewer(tk.Toplevel):
         self._detail_text = txt
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     root = tk.Tk()
     root.withdraw()
     ExcelTableViewer(root)